@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# pheme/cache.py
+# Copyright (C) 2020-2021 Greenbone AG
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Provides the django cache used by pheme.
+"""
+
+import os
+import pickle
+import re
+import shutil
+import zlib
+
+from django.core.cache.backends import filebased
+from django.core.files import locks
+
+# marks content which is stored as it is; zlib streams start with 0x78
+_RAW = b"\x00"
+
+_CHUNK = re.compile(r"^(?P<key>.+)/chunks/(?P<index>\d+)$")
+
+
+def chunk_key(key: str, index: int) -> str:
+    """
+    returns the key of a chunk of the value stored as key.
+
+    FileBasedCache keeps the chunks beside the entry of key; they are neither
+    counted nor culled on their own but removed together with that entry.
+    """
+    return f"{key}/chunks/{index}"
+
+
+class FileBasedCache(filebased.FileBasedCache):
+    """
+    A FileBasedCache storing bytes as they are.
+
+    The storage serializes and compresses the values itself; pickling and
+    compressing them again would just cost time.
+    """
+
+    def _key_to_file(self, key, version=None):
+        match = _CHUNK.match(key)
+        if not match:
+            return super()._key_to_file(key, version)
+        return os.path.join(
+            self.__chunks_of(super()._key_to_file(match["key"], version)),
+            match["index"] + self.cache_suffix,
+        )
+
+    def __chunks_of(self, fname: str) -> str:
+        return fname[: -len(self.cache_suffix)] + ".chunks"
+
+    def set(self, key, value, timeout=filebased.DEFAULT_TIMEOUT, version=None):
+        if not _CHUNK.match(key):
+            super().set(key, value, timeout, version)
+            return
+        directory = os.path.dirname(self._key_to_file(key, version))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        try:
+            super().set(key, value, timeout, version)
+        except FileNotFoundError:
+            # the entry got culled meanwhile; its chunks are incomplete and
+            # the entry is missing anyway
+            if os.path.isdir(directory):
+                raise
+
+    def _delete(self, fname):
+        deleted = super()._delete(fname)
+        if os.path.dirname(fname) == self._dir:
+            # culled, expired or deleted entries take their chunks with them
+            shutil.rmtree(self.__chunks_of(fname), ignore_errors=True)
+        return deleted
+
+    def _write_content(self, file, timeout, value):
+        if not isinstance(value, bytes):
+            super()._write_content(file, timeout, value)
+            return
+        expiry = self.get_backend_timeout(timeout)
+        file.write(pickle.dumps(expiry, self.pickle_protocol))
+        file.write(_RAW)
+        file.write(value)
+
+    @staticmethod
+    def __decode(content: bytes):
+        if content.startswith(_RAW):
+            return content[len(_RAW) :]
+        return pickle.loads(zlib.decompress(content))
+
+    def get(self, key, default=None, version=None):
+        fname = self._key_to_file(key, version)
+        try:
+            with open(fname, "rb") as f:
+                if not self._is_expired(f):
+                    return self.__decode(f.read())
+        except FileNotFoundError:
+            pass
+        return default
+
+    def touch(self, key, timeout=filebased.DEFAULT_TIMEOUT, version=None):
+        try:
+            with open(self._key_to_file(key, version), "r+b") as f:
+                try:
+                    locks.lock(f, locks.LOCK_EX)
+                    if self._is_expired(f):
+                        return False
+                    previous_value = self.__decode(f.read())
+                    f.seek(0)
+                    self._write_content(f, timeout, previous_value)
+                    return True
+                finally:
+                    locks.unlock(f)
+        except FileNotFoundError:
+            return False
@@ -19,3 +19,9 @@ class TemplateNotFoundError(Exception):
     """
     Is used when a template is not available within parameter of pheme.
     """
+
+
+class MissingChunkError(Exception):
+    """
+    Is used when hosts of a report stored in chunks are not available anymore.
+    """
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# pheme/jobs.py
+# Copyright (C) 2020-2021 Greenbone AG
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Runs long lasting work, like transforming big reports, in a local pool of
+worker threads after the request got answered.
+
+The state of a job is kept in the storage so that it can be requested from
+every process serving pheme.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+from uuid import uuid4
+
+from pheme import settings, storage
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+__lock = threading.Lock()
+# the executor and semaphore get created on first use so that each process
+# serving pheme has its own
+__pool_state: Dict = {}
+
+
+def __key(job_id: str) -> str:
+    return f"job/{job_id}"
+
+
+def __update(job_id: str, **changes):
+    job = storage.backend().load(__key(job_id)) or {"id": job_id}
+    job.update(changes)
+    storage.backend().store(__key(job_id), job)
+
+
+def __pool():
+    """
+    returns the executor and the semaphore limiting the amount of accepted
+    jobs to the workers and the queue depth.
+    """
+    with __lock:
+        if not __pool_state:
+            __pool_state["executor"] = ThreadPoolExecutor(
+                max_workers=settings.JOB_WORKERS,
+                thread_name_prefix="pheme-job",
+            )
+            __pool_state["slots"] = threading.BoundedSemaphore(
+                settings.JOB_WORKERS + settings.JOB_QUEUE_DEPTH
+            )
+        return __pool_state["executor"], __pool_state["slots"]
+
+
+def __run(job_id: str, work: Callable[[Callable[[int], None]], str], slots):
+    try:
+        __update(job_id, state=RUNNING)
+        name = work(lambda results: __update(job_id, results=results))
+        __update(job_id, state=DONE, name=name)
+    except Exception as error:  # pylint: disable=broad-except
+        logger.exception("job %s failed", job_id)
+        __update(job_id, state=FAILED, error=str(error))
+    finally:
+        slots.release()
+
+
+def submit(work: Callable[[Callable[[int], None]], str]) -> Optional[str]:
+    """
+    queues work and returns the id of the job or None when the queue is full.
+
+    work gets called with a function to report the amount of processed
+    results and returns the name of the stored result.
+    """
+    executor, slots = __pool()
+    if not slots.acquire(blocking=False):
+        return None
+    job_id = str(uuid4())
+    __update(job_id, state=QUEUED, results=0, name=None)
+    executor.submit(__run, job_id, work, slots)
+    return job_id
+
+
+def status(job_id: str) -> Optional[Dict]:
+    """
+    returns the state, the amount of processed results and the name of the
+    stored result of a job or None when the job is unknown.
+    """
+    return storage.backend().load(__key(job_id))
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# pheme/parser/batch.py
+# Copyright (C) 2020-2021 Greenbone AG
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Provides parsing support for uploads containing multiple reports.
+
+The reports are either uploaded as multipart files or within a tar or zip
+archive. Each report is kept as ReportFile which can be handed to another
+process to be parsed there.
+"""
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, Optional, Union
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from pheme import settings
+from pheme.parser.xml import _FILE_ENCODINGS, ReportStream
+
+# file name extensions of compressed reports and their encoding
+_EXTENSION_ENCODINGS = {
+    ".gz": "gzip",
+    ".zst": "zstd",
+}
+
+
+def _encoding_of(name: str) -> Optional[str]:
+    return _EXTENSION_ENCODINGS.get(os.path.splitext(name)[1].lower())
+
+
+@dataclass
+class ReportFile:
+    """
+    A report of a batch upload; content is either the report itself or the
+    path of a file containing it.
+    """
+
+    name: str
+    content: Union[bytes, str]
+    encoding: Optional[str] = None
+
+    @contextmanager
+    def open(self) -> Iterator[ReportStream]:
+        """
+        yields the report as ReportStream; the file is closed afterwards.
+        """
+        if isinstance(self.content, bytes):
+            source = io.BytesIO(self.content)
+        else:
+            source = open(self.content, "rb")
+        with source:
+            yield ReportStream(source, encoding=self.encoding)
+
+
+class ReportBatch(list):
+    """
+    A list of ReportFile.
+
+    Reports are kept in memory as long as all of them together fit into
+    TRANSFORM_SPOOL_SIZE; the others are copied into a temporary directory
+    which is removed on close.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.__directory = None
+        self.__in_memory = 0
+
+    def add(
+        self,
+        name: str,
+        source: BinaryIO,
+        encoding: Optional[str] = None,
+    ):
+        # the declared size of an archive member can not be trusted
+        remaining = max(settings.TRANSFORM_SPOOL_SIZE - self.__in_memory, 0)
+        content = source.read(remaining + 1)
+        if len(content) <= remaining:
+            self.__in_memory += len(content)
+            self.append(ReportFile(name, content, encoding))
+            return
+        if self.__directory is None:
+            self.__directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.__directory.name, str(len(self)))
+        with open(path, "wb") as target:
+            target.write(content)
+            shutil.copyfileobj(source, target)
+        self.append(ReportFile(name, path, encoding))
+
+    def close(self):
+        if self.__directory is not None:
+            self.__directory.cleanup()
+            self.__directory = None
+
+
+class BatchFormParser(BaseParser):
+    """
+    Returns each uploaded file of a multipart upload as ReportFile.
+
+    The encoding of a file is derived from its content type or, for unknown
+    content types, from its file name extension.
+    """
+
+    media_type = "multipart/form-data"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        batch = ReportBatch()
+        for report in stream.FILES.values():
+            if report.content_type in _FILE_ENCODINGS:
+                encoding = _FILE_ENCODINGS[report.content_type]
+            else:
+                encoding = _encoding_of(report.name)
+            if hasattr(report, "temporary_file_path"):
+                batch.append(
+                    ReportFile(
+                        report.name, report.temporary_file_path(), encoding
+                    )
+                )
+            else:
+                batch.add(report.name, report, encoding)
+        return batch
+
+
+class TarParser(BaseParser):
+    """
+    Returns each file of a tar archive, which may be compressed, as ReportFile.
+    """
+
+    media_type = "application/x-tar"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        batch = ReportBatch()
+        if stream is None:
+            return batch
+        try:
+            with tarfile.open(fileobj=stream, mode="r|*") as archive:
+                for member in archive:
+                    if member.isfile():
+                        batch.add(
+                            member.name,
+                            archive.extractfile(member),
+                            _encoding_of(member.name),
+                        )
+        except tarfile.TarError as error:
+            batch.close()
+            raise ParseError(f"tar parse error - {error}") from error
+        return batch
+
+
+class ZipParser(BaseParser):
+    """
+    Returns each file of a zip archive as ReportFile.
+    """
+
+    media_type = "application/zip"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        batch = ReportBatch()
+        if stream is None:
+            return batch
+        # zip archives have their index at the end and need to be seekable
+        with tempfile.SpooledTemporaryFile(
+            max_size=settings.TRANSFORM_SPOOL_SIZE
+        ) as spooled:
+            shutil.copyfileobj(stream, spooled)
+            try:
+                with zipfile.ZipFile(spooled) as archive:
+                    for info in archive.infolist():
+                        if not info.is_dir():
+                            with archive.open(info) as member:
+                                batch.add(
+                                    info.filename,
+                                    member,
+                                    _encoding_of(info.filename),
+                                )
+            except zipfile.BadZipFile as error:
+                batch.close()
+                raise ParseError(f"zip parse error - {error}") from error
+        return batch
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# pheme/parser/msgpack.py
+# Copyright (C) 2020-2021 Greenbone AG
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Provides msgpack parsing support.
+
+The msgpack package is optional; without it msgpack encoded data is rejected.
+"""
+
+from rest_framework.exceptions import ParseError, UnsupportedMediaType
+from rest_framework.parsers import BaseParser
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class MsgPackParser(BaseParser):
+    """
+    Parses msgpack encoded data into python structures like the JSONParser.
+    """
+
+    media_type = "application/msgpack"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if msgpack is None:
+            raise UnsupportedMediaType(
+                media_type, detail="msgpack is not installed"
+            )
+        try:
+            return msgpack.unpack(stream, raw=False)
+        except (ValueError, msgpack.UnpackException) as error:
+            raise ParseError(f"msgpack parse error - {error}") from error
@@ -22,11 +22,395 @@ Provides XML parsing support.
 Although there is the project djangorestframework-xml xmltodict seems to be more
 reliable for our usecase.
 
+For huge gvmd reports there is additionally a streaming variant which does not
+create a dict of the whole document but yields each result and host on its
+own. The yielded items are shaped the same way xmltodict would shape them so
+that they can be used interchangeably.
 """
 
+import gzip
+import hashlib
+import io
+import mmap
+import os
+import stat
+import tempfile
+from typing import Callable, Dict, Iterator, Optional, Tuple
+from xml.parsers import expat
+
 import xmltodict
+from rest_framework.exceptions import UnsupportedMediaType
 from rest_framework.parsers import BaseParser
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from pheme import settings
+
+
+def _push(item: Optional[Dict], key: str, value) -> Dict:
+    """
+    adds value to item under key; like xmltodict it turns repeated keys into a
+    list.
+    """
+    if item is None:
+        return {key: value}
+    if key in item:
+        existing = item[key]
+        if isinstance(existing, list):
+            existing.append(value)
+        else:
+            item[key] = [existing, value]
+    else:
+        item[key] = value
+    return item
+
+
+# roles of the elements on the stack of _ReportEventHandler
+_REPORT = "report"
+_RESULTS = "results"
+_ITEM = "item"
+_CHILD = "child"
+_IGNORED = None
+
+
+class _ReportEventHandler:
+    """
+    Builds the results, hosts and header of a gvmd report directly out of the
+    expat events.
+
+    Like xmltodict it keeps a stack of the open elements; unlike xmltodict it
+    only builds dicts for elements within a result, host or header element and
+    hands finished results and hosts over to pending instead of attaching
+    them to the report.
+
+    When there is a result_filter it is called with the incomplete result
+    after each of its children; as soon as it returns False the remaining
+    children of the result are skipped and the result gets dropped.
+
+    When there is a projection only the elements contained within it are
+    built, see ReportStream.
+    """
+
+    def __init__(
+        self,
+        result_filter: Optional[Callable[[Dict], bool]] = None,
+        projection: Optional[Dict] = None,
+    ):
+        # each frame is [role, name, item, data, projection, predicate]
+        self.stack = []
+        self.header = None
+        self.pending = []
+        self.result_filter = result_filter
+        self.projection = projection
+
+    def __role_of(self, name: str):
+        if not self.stack:
+            return _REPORT if name == "report" else _IGNORED
+        parent_role = self.stack[-1][0]
+        if parent_role in (_ITEM, _CHILD):
+            return _CHILD
+        if parent_role == _REPORT:
+            # sometimes gvmd reports have .report.report sometimes just
+            # .report
+            if name == "report":
+                return _REPORT
+            return _RESULTS if name == "results" else _ITEM
+        if parent_role == _RESULTS and name == "result":
+            return _ITEM
+        return _IGNORED
+
+    def start(self, name: str, attrs: Dict):
+        role = self.__role_of(name)
+        projection = None
+        if not self.stack:
+            projection = self.projection
+        elif role == _REPORT:
+            projection = self.stack[-1][4]
+        elif role is not _IGNORED and self.stack[-1][4] is not None:
+            # skips elements which are not within the projection of the parent
+            if name in self.stack[-1][4]:
+                projection = self.stack[-1][4][name]
+            else:
+                role = _IGNORED
+        predicate = None
+        if isinstance(projection, tuple):
+            projection, predicate = projection
+        if role == _ITEM and name == "result":
+            predicate = self.result_filter
+        if role == _REPORT:
+            self.header = attrs
+        self.stack.append(
+            [role, name, attrs or None, [], projection, predicate]
+        )
+
+    def end(self, name: str):
+        role, _, item, data, _, _ = self.stack.pop()
+        if role not in (_ITEM, _CHILD):
+            return
+        data = "".join(data).strip() or None
+        if item is None:
+            item = data
+        elif data:
+            item = _push(item, "text", data)
+        if role == _CHILD:
+            parent = self.stack[-1]
+            parent[2] = _push(parent[2], name, item)
+            if parent[5] is not None and not parent[5](parent[2]):
+                parent[0] = _IGNORED
+                parent[2] = None
+        elif name in ("result", "host"):
+            self.pending.append((name, item))
+        else:
+            _push(self.header, name, item)
+
+    def characters(self, data: str):
+        if self.stack and self.stack[-1][0] in (_ITEM, _CHILD):
+            self.stack[-1][3].append(data)
+
+
+class ReportStream:
+    """
+    Parses a gvmd report incrementally.
+
+    Iterating over it yields ("result", dict) for each result and
+    ("host", dict) for each host of the report while the XML is read. The
+    items are created directly from the parser events without building a
+    document first so that the memory usage depends on the biggest item
+    instead of the whole report.
+
+    Every other element of the report is collected within header, which is
+    None until the report element got found.
+
+    Results for which result_filter returns False are dropped while they are
+    parsed; result_filter must accept incomplete results.
+
+    A projection limits the elements which are built to the ones the
+    consumer uses. It is a dict of the element names within the report which
+    are kept; the value of a name is either None to keep the whole element,
+    a projection of its children or a tuple of the projection and a
+    predicate. The predicate works like the result_filter for that element.
+    Everything else is skipped while parsing. E.g.:
+
+    {
+        "scan_start": None,
+        "results": {"result": {"severity": None}},
+        "host": {"detail": ({"name": None}, lambda d: d.get("name") != "x")},
+    }
+
+    When set, progress is called with the amount of parsed results every
+    progress_interval results and once the report is parsed.
+
+    A source which is a file on disk is parsed memory mapped. A source
+    compressed with an encoding of gzip or zstd is kept compressed, e.g. when
+    it gets hashed or spooled, and decompressed while it is parsed.
+    """
+
+    chunk_size = 64 * 1024
+    # the amount of bytes kept in memory when the source needs to be copied;
+    # bigger sources are copied into a temporary file
+    spool_size = settings.TRANSFORM_SPOOL_SIZE
+    # the minimal amount of parsed results between two progress calls
+    progress_interval = 1000
+
+    def __init__(
+        self,
+        source,
+        result_filter: Optional[Callable[[Dict], bool]] = None,
+        projection: Optional[Dict] = None,
+        progress: Optional[Callable[[int], None]] = None,
+        encoding: Optional[str] = None,
+    ):
+        self.source = source
+        self.encoding = _content_encoding(encoding)
+        self.header = None
+        self.result_filter = result_filter
+        self.projection = projection
+        self.progress = progress
+
+    def sha256(self) -> str:
+        """
+        returns the sha256 hex digest of the source as it is, i.e. still
+        compressed.
+
+        The source gets read completely; when it cannot be read again it is
+        copied into a spooled temporary file while hashing, which gets parsed
+        afterwards instead.
+        """
+        digest = hashlib.sha256()
+        seekable = getattr(self.source, "seekable", lambda: False)()
+        self.__read(digest.update, copy=not seekable)
+        return digest.hexdigest()
+
+    def spool(self):
+        """
+        copies the source into a spooled temporary file which gets parsed
+        afterwards instead so that the source can be closed, e.g. to parse
+        an upload after the request got answered.
+        """
+        self.__read(lambda _: None, copy=True)
+
+    def __read(self, consume: Callable[[bytes], None], copy: bool):
+        """
+        reads the source completely passing each chunk to consume; when copy
+        is set the source gets replaced by a copy otherwise it gets rewound.
+        """
+        target = io.BytesIO() if copy else None
+        while True:
+            chunk = self.source.read(self.chunk_size)
+            if not chunk:
+                break
+            consume(chunk)
+            if target is None:
+                continue
+            target.write(chunk)
+            if (
+                isinstance(target, io.BytesIO)
+                and target.tell() > self.spool_size
+            ):
+                spooled = tempfile.TemporaryFile()
+                spooled.write(target.getbuffer())
+                target = spooled
+        if target is None:
+            self.source.seek(0)
+        else:
+            target.seek(0)
+            self.source = target
+
+    def __iter__(self) -> Iterator[Tuple[str, Dict]]:
+        handler = _ReportEventHandler(self.result_filter, self.projection)
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = handler.start
+        parser.EndElementHandler = handler.end
+        parser.CharacterDataHandler = handler.characters
+        results = 0
+        reported = 0
+        for _ in self.__parse(parser):
+            self.header = handler.header
+            if self.progress is not None:
+                results += sum(role == "result" for role, _ in handler.pending)
+                if results - reported >= self.progress_interval:
+                    self.progress(results)
+                    reported = results
+            yield from handler.pending
+            handler.pending.clear()
+        if self.progress is not None and results != reported:
+            self.progress(results)
+
+    def __mapped(self) -> Optional[mmap.mmap]:
+        """
+        returns the source memory mapped when it is a not empty file on disk
+        """
+        try:
+            fileno = self.source.fileno()
+        except (AttributeError, OSError, ValueError):
+            return None
+        status = os.fstat(fileno)
+        if not stat.S_ISREG(status.st_mode):
+            return None
+        if status.st_size <= self.source.tell():
+            return None
+        return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+
+    def __parse(self, parser) -> Iterator[None]:
+        """
+        feeds the source in chunks into parser and yields after each chunk
+        """
+        if self.encoding is not None:
+            mapped = None
+            source = _decompressed(self.source, self.encoding)
+        else:
+            mapped = self.__mapped()
+            source = self.source
+        if mapped is None:
+            while True:
+                chunk = source.read(self.chunk_size)
+                parser.Parse(chunk, not chunk)
+                yield
+                if not chunk:
+                    return
+        with mapped, memoryview(mapped) as view:
+            for start in range(self.source.tell(), len(view), self.chunk_size):
+                with view[start : start + self.chunk_size] as chunk:
+                    parser.Parse(chunk, False)
+                yield
+            parser.Parse(b"", True)
+            yield
+
+
+def _content_encoding(encoding: Optional[str]) -> Optional[str]:
+    """
+    returns encoding normalized to gzip, zstd or None when it is not encoded;
+    zstd requires zstandard to be installed.
+    """
+    encoding = encoding.lower() if encoding else None
+    if not encoding or encoding == "identity":
+        return None
+    if encoding in ("gzip", "x-gzip"):
+        return "gzip"
+    if encoding == "zstd" and zstandard is not None:
+        return "zstd"
+    raise UnsupportedMediaType(
+        encoding, detail=f"Unsupported content encoding {encoding}"
+    )
+
+
+def _decompressed(source, encoding: str):
+    """
+    returns source decompressing it while it is read
+    """
+    if encoding == "gzip":
+        return gzip.GzipFile(fileobj=source, mode="rb")
+    return zstandard.ZstdDecompressor().stream_reader(source)
+
+
+# content types of uploaded files and their encoding
+_FILE_ENCODINGS = {
+    "text/xml": None,
+    "application/gzip": "gzip",
+    "application/x-gzip": "gzip",
+    "application/zstd": "zstd",
+}
+
+
+class StreamingXMLFormParser(BaseParser):
+    """
+    Streaming variant of XMLFormParser returning a ReportStream.
+
+    Besides text/xml it accepts gzip and zstd compressed files.
+    """
+
+    media_type = "multipart/form-data"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        for report in stream.FILES.values():
+            if report.content_type in _FILE_ENCODINGS:
+                return ReportStream(
+                    report, encoding=_FILE_ENCODINGS[report.content_type]
+                )
+        return None
+
+
+class StreamingXMLParser(BaseParser):
+    """
+    Streaming variant of XMLParser returning a ReportStream.
+
+    A body with a Content-Encoding of gzip or zstd is decompressed while it is
+    parsed.
+    """
+
+    media_type = "application/xml"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = (parser_context or {}).get("request")
+        encoding = (
+            request.META.get("HTTP_CONTENT_ENCODING") if request else None
+        )
+        return ReportStream(stream, encoding=encoding)
+
 
 class XMLFormParser(BaseParser):
     """
@@ -39,7 +423,7 @@ class XMLFormParser(BaseParser):
         for report in stream.FILES.values():
             if report.content_type == "text/xml":
                 return xmltodict.parse(
-                    report.read(),
+                    report,
                     attr_prefix="",
                     cdata_key="text",
                     dict_constructor=dict,
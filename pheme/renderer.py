@@ -23,6 +23,8 @@ from typing import Dict, Generator, List, Union
 import xmltodict
 from rest_framework.renderers import BaseRenderer
 
+from pheme.transformation.scanreport.model import as_dict
+
 
 class CSVRenderer(BaseRenderer):
     media_type = "text/csv"
@@ -34,12 +36,25 @@ class CSVRenderer(BaseRenderer):
     ) -> Generator[Union[List[str], Dict], None, None]:
         # for the case that results is there but it is None
         results = data.pop("results", None) or []
+        by_nvt = data.get("grouping") == "nvt"
         send_keys = True
         for host in results:
-            for result in host.get("results"):
+            # within a report grouped by nvt the nvt fields are per group
+            group = (
+                {
+                    key: as_dict(value)
+                    for key, value in host.items()
+                    if key != "results"
+                }
+                if by_nvt
+                else {"os": host.get("os")}
+            )
+            tags = group.pop("nvt_tags_interpreted", {})
+            for result in map(as_dict, host.get("results")):
                 flatten = {
                     **data,
-                    "os": host.get("os"),
+                    **group,
+                    **tags,
                     **result.pop("nvt_tags_interpreted", {}),
                     **result,
                 }
@@ -119,4 +134,4 @@ class XMLRenderer(BaseRenderer):
         if data is None:
             return ""
 
-        return xmltodict.unparse(data)
+        return xmltodict.unparse(as_dict(data))
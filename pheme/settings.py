@@ -66,6 +66,27 @@ if SENTRY_DSN is not None:
     )
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = None
+# uploaded reports bigger than the spool size are kept within temporary files
+# instead of memory
+TRANSFORM_SPOOL_SIZE = int(
+    os.environ.get("PHEME_TRANSFORM_SPOOL_SIZE", str(2_621_440))
+)
+FILE_UPLOAD_MAX_MEMORY_SIZE = TRANSFORM_SPOOL_SIZE
+
+# reports with more results than the threshold are transformed by multiple
+# processes when there is more than one worker
+TRANSFORM_WORKERS = int(os.environ.get("PHEME_TRANSFORM_WORKERS", "1"))
+TRANSFORM_PARALLEL_THRESHOLD = int(
+    os.environ.get("PHEME_TRANSFORM_PARALLEL_THRESHOLD", "100000")
+)
+# amount of threads running asynchronous transform jobs and the amount of
+# jobs which may wait for a thread before new jobs get rejected
+JOB_WORKERS = int(os.environ.get("PHEME_JOB_WORKERS", "2"))
+JOB_QUEUE_DEPTH = int(os.environ.get("PHEME_JOB_QUEUE_DEPTH", "16"))
+# amount of processes transforming the reports of a batch upload concurrently
+TRANSFORM_BATCH_WORKERS = int(
+    os.environ.get("PHEME_TRANSFORM_BATCH_WORKERS", str(os.cpu_count() or 1))
+)
 
 PHEME_CONFIGURATION_PATH = Path(
     os.environ.get(
@@ -218,12 +239,29 @@ LOGGING = {
 # https://docs.djangoproject.com/en/3.1/topics/cache/
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "BACKEND": "pheme.cache.FileBasedCache",
         "LOCATION": "/tmp/django_cache",
         "TIMEOUT": 1 * 60 * 2 * 60,  # 2 hours
     }
 }
 
+# the storage of transformed reports, rendered reports and jobs; either django
+# to use the default cache, redis to share them between pheme instances or
+# sqlite to store reports per host and result
+STORAGE_BACKEND = os.environ.get("PHEME_STORAGE_BACKEND", "django")
+REDIS_URL = os.environ.get("PHEME_REDIS_URL", "redis://localhost:6379/0")
+SQLITE_PATH = os.environ.get("PHEME_SQLITE_PATH", "/tmp/pheme.sqlite3")
+STORAGE_TIMEOUT = CACHES["default"]["TIMEOUT"]
+# reports grouped by host are stored in chunks of hosts which are loaded
+# while the report is rendered
+STORAGE_CHUNK_SIZE = int(os.environ.get("PHEME_STORAGE_CHUNK_SIZE", "50"))
+# the codec of stored values, either pickle or msgpack, and their zstd level;
+# higher levels are smaller but slower to store
+STORAGE_CODEC = os.environ.get("PHEME_STORAGE_CODEC", "pickle")
+STORAGE_COMPRESSION_LEVEL = int(
+    os.environ.get("PHEME_STORAGE_COMPRESSION_LEVEL", "3")
+)
+
 # testing
 REST_FRAMEWORK = {
     "TEST_REQUEST_RENDERER_CLASSES": [
@@ -16,18 +16,1232 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-from typing import Dict
+"""
+Stores transformed reports and everything else pheme needs to keep between
+requests.
+
+The values are kept by a StorageBackend; by default the django cache is used.
+To share the values between multiple pheme instances PHEME_STORAGE_BACKEND can
+be set to redis, which requires the redis package, to use the server at
+PHEME_REDIS_URL instead.
+
+With PHEME_STORAGE_BACKEND set to sqlite the reports are stored per host and
+result within the SQLite database at PHEME_SQLITE_PATH so that load_host,
+load_results and count_results do not need to load the whole report.
+
+The values are serialized by dumps into a versioned format compressed by
+zstd.
+"""
+
+import gc
+import logging
+import math
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections.abc import Sequence
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from uuid import uuid4
 
-from django.core.cache import cache
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+
+from pheme import settings
+from pheme.cache import chunk_key
+from pheme.errors import MissingChunkError
+from pheme.transformation.scanreport.model import (
+    HostResult,
+    Note,
+    NVTResult,
+    Occurrence,
+    Override,
+    Result,
+)
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# serialized values start with the magic, the format version and the codec
+_MAGIC = b"PHM"
+_VERSION = 1
+_PICKLE_ZSTD = b"p"
+_MSGPACK_ZSTD = b"m"
+_PICKLE_ZLIB = b"z"
+
+# msgpack extension types; entries and the first occurrence of a shared
+# mapping are packed as lists starting with a marker
+_EXT_ENTRY = 1
+_EXT_SHARED = 2
+_EXT_SHARED_REFERENCE = 3
+_EXT_TUPLE = 4
+_EXT_SET = 5
+
+# the entries are stored by their position within _ENTRY_TYPES
+_ENTRY_TYPES = (Note, Override, Result, HostResult, Occurrence, NVTResult)
+_ENTRY_MARKERS = {
+    entry_type: msgpack.ExtType(_EXT_ENTRY, bytes([code]))
+    for code, entry_type in enumerate(_ENTRY_TYPES)
+    if msgpack is not None
+}
+
+
+class _Marker:
+    __slots__ = ("code", "data")
+
+    def __init__(self, code: int, data: bytes):
+        self.code = code
+        self.data = data
+
+
+def __msgpack_dumps(value: Any) -> bytes:
+    """
+    packs value with msgpack.
+
+    The report entries are packed as a list of their slots and mappings
+    shared between entries, like the NVT fields of results, are packed once
+    and referenced afterwards, like pickle does.
+    """
+    shared = {}
+
+    def share(item):
+        if not isinstance(item, dict):
+            return item
+        if id(item) in shared:
+            index = shared[id(item)][0]
+            return msgpack.ExtType(
+                _EXT_SHARED_REFERENCE, index.to_bytes(4, "little")
+            )
+        # the item is kept so that its id does not get reused
+        shared[id(item)] = (len(shared), item)
+        return [msgpack.ExtType(_EXT_SHARED, b""), item]
+
+    def default(item):
+        marker = _ENTRY_MARKERS.get(type(item))
+        if marker is not None:
+            return [marker] + [
+                share(getattr(item, slot))
+                if slot.startswith("_")
+                else getattr(item, slot)
+                for slot in item.__slots__
+            ]
+        # subclasses like Counter or namedtuples would lose their type;
+        # the TypeError lets dumps pickle the value instead
+        if type(item) is tuple:
+            return msgpack.ExtType(_EXT_TUPLE, pack(list(item)))
+        if type(item) is set:
+            return msgpack.ExtType(_EXT_SET, pack(list(item)))
+        raise TypeError(f"can not serialize {type(item)}")
+
+    def pack(item) -> bytes:
+        return msgpack.packb(
+            item, default=default, strict_types=True, use_bin_type=True
+        )
+
+    return pack(value)
+
+
+def __msgpack_loads(data: bytes) -> Any:
+    shared = []
+    # short values of entries like threats, ports and hostnames are repeated
+    # throughout a report; they are shared again like after transforming
+    strings = {}
+
+    def dedup(value):
+        if isinstance(value, str) and len(value) <= 64:
+            return strings.setdefault(value, value)
+        return value
+
+    def list_hook(items: List):
+        marker = items[0] if items else None
+        if not isinstance(marker, _Marker):
+            return items
+        if marker.code == _EXT_ENTRY:
+            entry_type = _ENTRY_TYPES[marker.data[0]]
+            return entry_type(*[dedup(item) for item in items[1:]])
+        shared.append(items[1])
+        return items[1]
+
+    def ext_hook(code: int, data: bytes):
+        if code in (_EXT_ENTRY, _EXT_SHARED):
+            return _Marker(code, data)
+        if code == _EXT_SHARED_REFERENCE:
+            return shared[int.from_bytes(data, "little")]
+        if code == _EXT_TUPLE:
+            return tuple(unpack(data))
+        if code == _EXT_SET:
+            return set(unpack(data))
+        return msgpack.ExtType(code, data)
+
+    def unpack(item: bytes):
+        return msgpack.unpackb(
+            item,
+            ext_hook=ext_hook,
+            list_hook=list_hook,
+            raw=False,
+            strict_map_key=False,
+        )
+
+    return unpack(data)
+
+
+def __header(codec: bytes) -> bytes:
+    return _MAGIC + bytes([_VERSION]) + codec
+
+
+def dumps(value: Any) -> bytes:
+    """
+    serializes value into bytes starting with a header of the format.
+
+    By default value is pickled and compressed with zstd at
+    PHEME_STORAGE_COMPRESSION_LEVEL. With PHEME_STORAGE_CODEC set to msgpack
+    it is packed with msgpack instead; values msgpack cannot pack are pickled
+    anyway. Without zstandard zlib is used.
+    """
+    if zstandard is None:
+        return __header(_PICKLE_ZLIB) + zlib.compress(
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL), 1
+        )
+    compressor = zstandard.ZstdCompressor(
+        level=settings.STORAGE_COMPRESSION_LEVEL
+    )
+    if settings.STORAGE_CODEC == "msgpack" and msgpack is not None:
+        try:
+            return __header(_MSGPACK_ZSTD) + compressor.compress(
+                __msgpack_dumps(value)
+            )
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return __header(_PICKLE_ZSTD) + compressor.compress(
+        pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    )
+
+
+def loads(data: Any) -> Any:
+    """
+    deserializes data created by dumps.
+
+    Values stored before dumps existed, e.g. rendered reports as bytes or
+    values unpickled by the django cache, are returned as they are.
+    """
+    if not isinstance(data, bytes) or not data.startswith(_MAGIC):
+        return data
+    # a report consists of a lot of objects; collecting garbage while they
+    # are created would traverse them over and over again
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return __loads(data)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def __loads(data: bytes) -> Any:
+    header = len(_MAGIC) + 2
+    version, codec = data[len(_MAGIC)], data[header - 1 : header]
+    if version > _VERSION:
+        raise ValueError(f"Unsupported storage format version {version}")
+    if codec == _PICKLE_ZLIB:
+        return pickle.loads(zlib.decompress(data[header:]))
+    if zstandard is None or (codec == _MSGPACK_ZSTD and msgpack is None):
+        raise ImproperlyConfigured(
+            "zstandard and for msgpack encoded values msgpack are required"
+        )
+    content = zstandard.ZstdDecompressor().decompress(data[header:])
+    if codec == _PICKLE_ZSTD:
+        return pickle.loads(content)
+    if codec == _MSGPACK_ZSTD:
+        return __msgpack_loads(content)
+    raise ValueError(f"Unknown storage codec {codec!r}")
+
+
+class LazyHosts(Sequence):
+    """
+    The hosts of a report which are stored in chunks of chunk_size hosts.
+
+    A chunk is loaded when one of its hosts is accessed and only the last
+    loaded chunk is kept so that iterating over the hosts, e.g. while
+    rendering, keeps just one chunk in memory.
+
+    When results_limit is set the results of each host are cut to it.
+    result_counts contains the amount of results of every host of the report
+    so that limits can be checked without loading the chunks.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        length: int,
+        chunk_size: int,
+        *,
+        offset: int = 0,
+        results_limit: Optional[int] = None,
+        result_counts: Optional[List[int]] = None,
+        storage: Optional["StorageBackend"] = None,
+    ):
+        self.name = name
+        self.length = length
+        self.chunk_size = chunk_size
+        self.offset = offset
+        self.results_limit = results_limit
+        self.result_counts = result_counts
+        self.storage = storage
+        self.__chunk = (None, [])
+
+    def __getstate__(self) -> Dict:
+        return {
+            "name": self.name,
+            "length": self.length,
+            "chunk_size": self.chunk_size,
+            "offset": self.offset,
+            "results_limit": self.results_limit,
+            "result_counts": self.result_counts,
+        }
+
+    def __setstate__(self, state: Dict):
+        self.__init__(state.pop("name"), state.pop("length"), **state)
+
+    def __copy(self, **changes) -> "LazyHosts":
+        state = {**self.__getstate__(), "storage": self.storage, **changes}
+        return LazyHosts(state.pop("name"), state.pop("length"), **state)
+
+    def limited(self, results_limit: int) -> "LazyHosts":
+        """
+        returns the hosts with at most results_limit results each.
+        """
+        return self.__copy(results_limit=results_limit)
+
+    def results_per_host(self) -> Optional[List[int]]:
+        """
+        returns the amount of results of each host or None when unknown.
+        """
+        if self.result_counts is None:
+            return None
+        return self.result_counts[self.offset : self.offset + self.length]
+
+    def chunk_names(self) -> List[str]:
+        first = self.offset // self.chunk_size
+        last = (self.offset + self.length - 1) // self.chunk_size
+        return [
+            chunk_name(self.name, index) for index in range(first, last + 1)
+        ]
+
+    def __load(self, index: int) -> List[HostResult]:
+        if self.__chunk[0] != index:
+            self.__chunk = (None, [])
+            hosts = (self.storage or backend()).load_chunk(
+                self.name, index, self.chunk_size
+            )
+            if self.results_limit is not None:
+                for host in hosts:
+                    host.results = host.results[: self.results_limit]
+            self.__chunk = (index, hosts)
+        return self.__chunk[1]
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return self.__copy(
+                offset=self.offset + start, length=max(stop - start, 0)
+            )
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError(index)
+        position = self.offset + index
+        hosts = self.__load(position // self.chunk_size)
+        if position % self.chunk_size >= len(hosts):
+            raise MissingChunkError(
+                chunk_name(self.name, position // self.chunk_size)
+            )
+        return hosts[position % self.chunk_size]
+
+    def __iter__(self) -> Iterator[HostResult]:
+        # iterates without the cached chunk so that it can be dropped
+        position = self.offset
+        end = self.offset + self.length
+        while position < end:
+            index = position // self.chunk_size
+            hosts = LazyHosts.__load(self.__copy(), index)
+            first = position - index * self.chunk_size
+            last = min(end - index * self.chunk_size, self.chunk_size)
+            if len(hosts) < last:
+                # yielding less hosts than len would truncate the report
+                raise MissingChunkError(chunk_name(self.name, index))
+            yield from hosts[first:last]
+            position = (index + 1) * self.chunk_size
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (list, LazyHosts)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"LazyHosts({self.name!r}, {self.length})"
+
+
+def chunk_name(name: str, index: int) -> str:
+    return chunk_key(name, index)
+
+
+class ChangedHosts:
+    """
+    The hosts of a report stored in chunks which get changed or extended in
+    place, e.g. when appending results.
+
+    Only the chunks of accessed hosts are loaded and kept so that just those
+    are stored again by StorageBackend.update_report.
+    """
+
+    def __init__(self, hosts: LazyHosts):
+        self.name = hosts.name
+        self.chunk_size = hosts.chunk_size
+        self.storage = hosts.storage or backend()
+        self.stored = len(hosts)
+        self.result_counts = list(
+            hosts.results_per_host() or (len(host.results) for host in hosts)
+        )
+        self.chunks: Dict[int, List[HostResult]] = {}
+        self.changed = set()
+
+    def __chunk(self, index: int) -> List[HostResult]:
+        if index not in self.chunks:
+            self.chunks[index] = (
+                list(self.storage.load_chunk(self.name, index, self.chunk_size))
+                if index * self.chunk_size < self.stored
+                else []
+            )
+        return self.chunks[index]
+
+    def __len__(self) -> int:
+        return len(self.result_counts)
+
+    def __position(self, index: int) -> int:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return index
+
+    def __getitem__(self, index: int) -> HostResult:
+        position = self.__position(index)
+        hosts = self.__chunk(position // self.chunk_size)
+        if position % self.chunk_size >= len(hosts):
+            raise MissingChunkError(
+                chunk_name(self.name, position // self.chunk_size)
+            )
+        return hosts[position % self.chunk_size]
+
+    def __setitem__(self, index: int, host: HostResult):
+        position = self.__position(index)
+        hosts = self.__chunk(position // self.chunk_size)
+        hosts[position % self.chunk_size] = host
+        self.result_counts[position] = len(host.results)
+        self.changed.add(position)
+
+    def append(self, host: HostResult):
+        position = len(self)
+        self.__chunk(position // self.chunk_size).append(host)
+        self.result_counts.append(len(host.results))
+        self.changed.add(position)
+
+    def __iter__(self) -> Iterator[HostResult]:
+        # chunks which are not kept are loaded just for the iteration
+        for index in range(math.ceil(len(self) / self.chunk_size)):
+            if index in self.chunks:
+                yield from self.chunks[index]
+            else:
+                yield from self.storage.load_chunk(
+                    self.name, index, self.chunk_size
+                )
+
+    def changed_chunks(self) -> Dict[int, List[HostResult]]:
+        """
+        returns the chunks containing changed or added hosts by their index.
+        """
+        indices = {position // self.chunk_size for position in self.changed}
+        return {index: self.chunks[index] for index in sorted(indices)}
+
+    def lazy(self) -> LazyHosts:
+        """
+        returns the LazyHosts of the changed hosts stored as name.
+        """
+        return LazyHosts(
+            self.name,
+            len(self),
+            self.chunk_size,
+            result_counts=self.result_counts,
+            storage=self.storage,
+        )
+
+
+class StorageBackend:
+    """
+    Interface of the storages of pheme; values expire after the timeout of
+    the backend unless they get touched.
+    """
+
+    def load(self, name: str) -> Any:
+        raise NotImplementedError()
+
+    def store(self, name: str, value: Any):
+        raise NotImplementedError()
+
+    def store_many(self, values: Dict[str, Any]):
+        for name, value in values.items():
+            self.store(name, value)
+
+    def delete(self, *names: str):
+        raise NotImplementedError()
+
+    def exists(self, name: str) -> bool:
+        raise NotImplementedError()
+
+    def get_many(self, names: Iterable[str]) -> Dict[str, Any]:
+        """
+        returns the values of the stored names; missing names are left out.
+        """
+        raise NotImplementedError()
+
+    def touch(self, name: str) -> bool:
+        """
+        refreshes the expiry of name and returns False if it is missing.
+        """
+        raise NotImplementedError()
+
+    def missing(self, names: List[str]) -> List[str]:
+        """
+        returns the names which are not stored.
+        """
+        return [name for name in names if not self.exists(name)]
+
+    def store_report(
+        self,
+        name: str,
+        report: Dict,
+        chunk_size: Optional[int] = None,
+    ):
+        """
+        stores a report grouped by host as a header containing everything but
+        the hosts and chunks of chunk_size hosts; the header is loaded with
+        LazyHosts as results.
+        """
+        chunk_size = chunk_size or settings.STORAGE_CHUNK_SIZE
+        hosts = report["results"]
+        chunks = {
+            chunk_name(name, index): hosts[start : start + chunk_size]
+            for index, start in enumerate(range(0, len(hosts), chunk_size))
+        }
+        header = {
+            **report,
+            "results": LazyHosts(
+                name,
+                len(hosts),
+                chunk_size,
+                result_counts=[len(host.results) for host in hosts],
+            ),
+        }
+        # the header is stored last so that it never references missing chunks
+        self.store_many({**chunks, name: header})
+
+    def update_report(self, name: str, report: Dict):
+        """
+        stores the header and the changed chunks of the report name whose
+        results are ChangedHosts; the remaining chunks are just touched.
+        """
+        hosts = report["results"]
+        chunks = hosts.changed_chunks()
+        for index in range(math.ceil(hosts.stored / hosts.chunk_size)):
+            if index not in chunks:
+                self.touch(chunk_name(name, index))
+        self.store_many(
+            {
+                **{
+                    chunk_name(name, index): chunk
+                    for index, chunk in chunks.items()
+                },
+                name: {**report, "results": hosts.lazy()},
+            }
+        )
+
+    def touch_report(self, name: str) -> bool:
+        """
+        refreshes the expiry of the report stored as name and of the chunks of
+        its hosts without loading it; returns False if it is missing.
+        """
+        if not self.touch(name):
+            return False
+        index = 0
+        while self.touch(chunk_name(name, index)):
+            index += 1
+        return True
+
+    def load_chunk(
+        self, name: str, index: int, chunk_size: int
+    ) -> List[HostResult]:
+        """
+        returns the hosts of a chunk of the report stored as name; raises
+        MissingChunkError when the chunk expired or got culled.
+        """
+        hosts = self.load(chunk_name(name, index))
+        if hosts is None:
+            raise MissingChunkError(chunk_name(name, index))
+        return hosts
+
+    def _bound(self, value: Any) -> Any:
+        """
+        lets the LazyHosts of a loaded report header load from this storage.
+
+        A report with missing chunks is handled like a missing report and
+        None is returned.
+        """
+        if isinstance(value, dict) and isinstance(
+            value.get("results"), LazyHosts
+        ):
+            hosts = value["results"]
+            missing = self.missing(hosts.chunk_names())
+            if missing:
+                logger.warning("%s misses the chunks %s", hosts.name, missing)
+                return None
+            hosts.storage = self
+        return value
+
+    def load_host(self, name: str, host: str) -> Optional[HostResult]:
+        """
+        returns the results of host within the report stored as name.
+        """
+        report = self.load(name) or {}
+        for host_result in report.get("results", []):
+            if isinstance(host_result, HostResult) and host_result.host == host:
+                return host_result
+        return None
+
+    def load_results(
+        self,
+        name: str,
+        *,
+        host: Optional[str] = None,
+        oid: Optional[str] = None,
+        threat: Optional[str] = None,
+        min_severity: Optional[float] = None,
+    ) -> List[Result]:
+        """
+        returns the results of the report stored as name matching the given
+        host, NVT oid, threat and minimal severity.
+        """
+        report = self.load(name) or {}
+        return [
+            result
+            for host_result in report.get("results", [])
+            if isinstance(host_result, HostResult)
+            and (host is None or host_result.host == host)
+            for result in host_result.results
+            if (oid is None or result.get("nvt_oid") == oid)
+            and (threat is None or result.threat == threat)
+            and (
+                min_severity is None
+                or float(result.severity or 0) >= min_severity
+            )
+        ]
+
+    def count_results(self, name: str, **criteria) -> int:
+        """
+        returns the amount of results load_results would return.
+        """
+        return len(self.load_results(name, **criteria))
+
+
+class DjangoCacheBackend(StorageBackend):
+    """
+    Stores the values within a django cache.
+    """
+
+    def __init__(self, alias: str = "default"):
+        self.cache = caches[alias]
+
+    def load(self, name: str) -> Any:
+        return self._bound(loads(self.cache.get(name)))
+
+    def store(self, name: str, value: Any):
+        self.cache.set(name, dumps(value))
+
+    def store_many(self, values: Dict[str, Any]):
+        self.cache.set_many(
+            {name: dumps(value) for name, value in values.items()}
+        )
+
+    def delete(self, *names: str):
+        self.cache.delete_many(names)
+
+    def exists(self, name: str) -> bool:
+        return self.cache.has_key(name)
+
+    def get_many(self, names: Iterable[str]) -> Dict[str, Any]:
+        return {
+            name: loads(value)
+            for name, value in self.cache.get_many(names).items()
+        }
+
+    def touch(self, name: str) -> bool:
+        return self.cache.touch(name)
+
+
+class RedisBackend(StorageBackend):
+    """
+    Stores the serialized values within a server speaking the redis protocol.
+
+    The connections are pooled; storing multiple values is done within a
+    pipeline.
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        *,
+        timeout: int = settings.STORAGE_TIMEOUT,
+        prefix: str = "pheme:",
+        client=None,
+    ):
+        if client is None:
+            if redis is None:
+                raise ImproperlyConfigured(
+                    "redis is required for the redis storage backend"
+                )
+            client = redis.Redis(
+                connection_pool=redis.ConnectionPool.from_url(url)
+            )
+        self.client = client
+        self.timeout = timeout
+        self.prefix = prefix
+
+    def __key(self, name: str) -> str:
+        return f"{self.prefix}{name}"
+
+    def load(self, name: str) -> Any:
+        value = self.client.get(self.__key(name))
+        return None if value is None else self._bound(loads(value))
+
+    def store(self, name: str, value: Any):
+        self.client.set(self.__key(name), dumps(value), ex=self.timeout)
+
+    def store_many(self, values: Dict[str, Any]):
+        with self.client.pipeline(transaction=False) as pipeline:
+            for name, value in values.items():
+                pipeline.set(self.__key(name), dumps(value), ex=self.timeout)
+            pipeline.execute()
+
+    def delete(self, *names: str):
+        if names:
+            self.client.delete(*[self.__key(name) for name in names])
+
+    def exists(self, name: str) -> bool:
+        return self.client.exists(self.__key(name)) > 0
+
+    def missing(self, names: List[str]) -> List[str]:
+        with self.client.pipeline(transaction=False) as pipeline:
+            for name in names:
+                pipeline.exists(self.__key(name))
+            found = pipeline.execute()
+        return [name for name, exists in zip(names, found) if not exists]
+
+    def get_many(self, names: Iterable[str]) -> Dict[str, Any]:
+        names = list(names)
+        if not names:
+            return {}
+        values = self.client.mget([self.__key(name) for name in names])
+        return {
+            name: loads(value)
+            for name, value in zip(names, values)
+            if value is not None
+        }
+
+    def touch(self, name: str) -> bool:
+        return bool(self.client.expire(self.__key(name), self.timeout))
+
+
+def _is_indexable(value: Any) -> bool:
+    """
+    returns True for transformed reports grouped by host
+    """
+    return (
+        isinstance(value, dict)
+        and value.get("grouping", "host") == "host"
+        and isinstance(value.get("results"), list)
+        and all(isinstance(result, HostResult) for result in value["results"])
+    )
+
+
+# the slots of a result besides _nvt which is stored once per NVT
+_RESULT_SLOTS = tuple(slot for slot in Result.__slots__ if slot != "_nvt")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS value (
+    name TEXT PRIMARY KEY,
+    expires REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS report (
+    name TEXT PRIMARY KEY,
+    expires REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS host (
+    report TEXT NOT NULL REFERENCES report (name) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    host TEXT,
+    data BLOB NOT NULL,
+    PRIMARY KEY (report, position)
+);
+CREATE TABLE IF NOT EXISTS nvt (
+    report TEXT NOT NULL REFERENCES report (name) ON DELETE CASCADE,
+    id INTEGER NOT NULL,
+    oid TEXT,
+    data BLOB NOT NULL,
+    PRIMARY KEY (report, id)
+);
+CREATE TABLE IF NOT EXISTS result (
+    report TEXT NOT NULL REFERENCES report (name) ON DELETE CASCADE,
+    host INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    nvt INTEGER NOT NULL,
+    oid TEXT,
+    threat TEXT,
+    severity REAL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (report, host, position)
+);
+CREATE INDEX IF NOT EXISTS value_expires ON value (expires);
+CREATE INDEX IF NOT EXISTS report_expires ON report (expires);
+CREATE INDEX IF NOT EXISTS host_host ON host (report, host);
+CREATE INDEX IF NOT EXISTS result_severity ON result (report, severity);
+CREATE INDEX IF NOT EXISTS result_threat ON result (report, threat);
+CREATE INDEX IF NOT EXISTS result_oid ON result (report, oid);
+"""
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Stores the values within a SQLite database.
+
+    Reports grouped by host are stored in the tables report, host, nvt and
+    result; the columns used for lookups are indexed and the remaining
+    fields are pickled per row. Every other value is serialized as a whole.
+
+    Each thread and process uses its own connection.
+    """
+
+    def __init__(
+        self,
+        path: str = settings.SQLITE_PATH,
+        *,
+        timeout: int = settings.STORAGE_TIMEOUT,
+    ):
+        self.path = path
+        self.timeout = timeout
+        self.__local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        local = self.__local
+        if getattr(local, "pid", None) != os.getpid():
+            local.connection = sqlite3.connect(self.path, timeout=30)
+            local.connection.execute("PRAGMA journal_mode=WAL")
+            local.connection.execute("PRAGMA foreign_keys=ON")
+            local.connection.executescript(_SCHEMA)
+            local.pid = os.getpid()
+        return local.connection
+
+    def __expires(self) -> float:
+        return time.time() + self.timeout
+
+    def load(self, name: str) -> Any:
+        now = time.time()
+        row = self.connection.execute(
+            "SELECT data FROM value WHERE name = ? AND expires > ?",
+            (name, now),
+        ).fetchone()
+        if row:
+            return loads(row[0])
+        row = self.connection.execute(
+            "SELECT data FROM report WHERE name = ? AND expires > ?",
+            (name, now),
+        ).fetchone()
+        if not row:
+            return None
+        report = pickle.loads(row[0])
+        # the report row contains the amount of results per host as results
+        counts = report["results"]
+        report["results"] = LazyHosts(
+            name,
+            len(counts),
+            settings.STORAGE_CHUNK_SIZE,
+            result_counts=counts,
+            storage=self,
+        )
+        return report
+
+    def store_report(
+        self,
+        name: str,
+        report: Dict,
+        chunk_size: Optional[int] = None,
+    ):
+        # the hosts are rows already which can be loaded in any chunk size
+        self.store(name, report)
+
+    def update_report(self, name: str, report: Dict):
+        # just the rows of the changed hosts are replaced
+        hosts = report["results"]
+        positions = sorted(hosts.changed)
+        with self.connection as connection:
+            connection.execute(
+                "UPDATE report SET expires = ?, data = ? WHERE name = ?",
+                (
+                    self.__expires(),
+                    pickle.dumps({**report, "results": hosts.result_counts}),
+                    name,
+                ),
+            )
+            for table, column in (("result", "host"), ("host", "position")):
+                connection.executemany(
+                    f"DELETE FROM {table} WHERE report = ? AND {column} = ?",
+                    ((name, position) for position in positions),
+                )
+            self.__insert_hosts(
+                connection,
+                name,
+                [(position, hosts[position]) for position in positions],
+            )
+
+    def touch_report(self, name: str) -> bool:
+        return self.touch(name)
+
+    def load_chunk(
+        self, name: str, index: int, chunk_size: int
+    ) -> List[HostResult]:
+        return self.__hosts(
+            name,
+            "AND position >= ? AND position < ?",
+            (index * chunk_size, (index + 1) * chunk_size),
+        )
+
+    def store(self, name: str, value: Any):
+        self.store_many({name: value})
+
+    def store_many(self, values: Dict[str, Any]):
+        with self.connection as connection:
+            connection.execute(
+                "DELETE FROM value WHERE expires <= ?", (time.time(),)
+            )
+            connection.execute(
+                "DELETE FROM report WHERE expires <= ?", (time.time(),)
+            )
+            for name, value in values.items():
+                self.__delete(connection, [name])
+                if _is_indexable(value):
+                    self.__insert_report(connection, name, value)
+                else:
+                    connection.execute(
+                        "INSERT INTO value VALUES (?, ?, ?)",
+                        (name, self.__expires(), dumps(value)),
+                    )
+
+    def __insert_report(self, connection, name: str, value: Dict):
+        hosts = value["results"]
+        counts = [len(host_result.results) for host_result in hosts]
+        connection.execute(
+            "INSERT INTO report VALUES (?, ?, ?)",
+            (
+                name,
+                self.__expires(),
+                pickle.dumps({**value, "results": counts}),
+            ),
+        )
+        self.__insert_hosts(connection, name, list(enumerate(hosts)))
+
+    @staticmethod
+    def __insert_hosts(
+        connection, name: str, hosts: List[Tuple[int, HostResult]]
+    ):
+        """
+        inserts the rows of hosts by their position within the report name
+        """
+
+        def host_rows():
+            for position, host_result in hosts:
+                results = host_result.results
+                host_result.results = []
+                try:
+                    data = pickle.dumps(host_result)
+                finally:
+                    host_result.results = results
+                yield name, position, host_result.host, data
+
+        # results of the same NVT share their nvt fields
+        nvts = {}
+        first_nvt = connection.execute(
+            "SELECT coalesce(max(id) + 1, 0) FROM nvt WHERE report = ?",
+            (name,),
+        ).fetchone()[0]
+
+        def result_rows():
+            for position, host_result in hosts:
+                for number, result in enumerate(host_result.results):
+                    nvt = result._nvt  # pylint: disable=protected-access
+                    if id(nvt) not in nvts:
+                        nvts[id(nvt)] = (first_nvt + len(nvts), nvt)
+                    yield (
+                        name,
+                        position,
+                        number,
+                        nvts[id(nvt)][0],
+                        nvt.get("nvt_oid"),
+                        result.threat,
+                        float(result.severity or 0),
+                        pickle.dumps(
+                            tuple(
+                                getattr(result, slot) for slot in _RESULT_SLOTS
+                            )
+                        ),
+                    )
+
+        connection.executemany(
+            "INSERT INTO host VALUES (?, ?, ?, ?)", host_rows()
+        )
+        connection.executemany(
+            "INSERT INTO result VALUES (?, ?, ?, ?, ?, ?, ?, ?)", result_rows()
+        )
+        # the nvts are collected while the results are inserted
+        connection.executemany(
+            "INSERT INTO nvt VALUES (?, ?, ?, ?)",
+            (
+                (name, number, nvt.get("nvt_oid"), pickle.dumps(nvt))
+                for number, nvt in nvts.values()
+            ),
+        )
+
+    def __results(
+        self, name: str, condition: str, parameter: tuple = ()
+    ) -> Dict[int, List[Result]]:
+        """
+        returns the results of name matching condition per host position
+        """
+        nvts = {}
+        per_host = {}
+        rows = self.connection.execute(
+            "SELECT result.host, nvt.id, nvt.data, result.data FROM result"
+            " JOIN nvt ON nvt.report = result.report AND nvt.id = result.nvt"
+            f" WHERE result.report = ? {condition}"
+            " ORDER BY result.host, result.position",
+            (name, *parameter),
+        )
+        for host, nvt_id, nvt, data in rows:
+            if nvt_id not in nvts:
+                nvts[nvt_id] = pickle.loads(nvt)
+            values = dict(zip(_RESULT_SLOTS, pickle.loads(data)))
+            per_host.setdefault(host, []).append(
+                Result(_nvt=nvts[nvt_id], **values)
+            )
+        return per_host
+
+    def __hosts(
+        self, name: str, condition: str, parameter: tuple = ()
+    ) -> List[HostResult]:
+        """
+        returns the hosts of name matching condition including their results
+        """
+        rows = self.connection.execute(
+            "SELECT position, data FROM host"
+            f" WHERE report = ? {condition} ORDER BY position",
+            (name, *parameter),
+        ).fetchall()
+        if not rows:
+            return []
+        results = self.__results(
+            name,
+            "AND result.host BETWEEN ? AND ?",
+            (rows[0][0], rows[-1][0]),
+        )
+        hosts = []
+        for position, data in rows:
+            host_result = pickle.loads(data)
+            host_result.results = results.get(position, [])
+            hosts.append(host_result)
+        return hosts
+
+    @staticmethod
+    def __delete(connection, names: Iterable[str]):
+        for name in names:
+            connection.execute("DELETE FROM value WHERE name = ?", (name,))
+            connection.execute("DELETE FROM report WHERE name = ?", (name,))
+
+    def delete(self, *names: str):
+        with self.connection as connection:
+            self.__delete(connection, names)
+
+    def exists(self, name: str) -> bool:
+        now = time.time()
+        return any(
+            self.connection.execute(
+                f"SELECT 1 FROM {table} WHERE name = ? AND expires > ?",
+                (name, now),
+            ).fetchone()
+            for table in ("value", "report")
+        )
+
+    def get_many(self, names: Iterable[str]) -> Dict[str, Any]:
+        values = {name: self.load(name) for name in names}
+        return {
+            name: value for name, value in values.items() if value is not None
+        }
+
+    def touch(self, name: str) -> bool:
+        now = time.time()
+        with self.connection as connection:
+            return any(
+                connection.execute(
+                    f"UPDATE {table} SET expires = ?"
+                    " WHERE name = ? AND expires > ?",
+                    (self.__expires(), name, now),
+                ).rowcount
+                for table in ("value", "report")
+            )
+
+    def __alive(self, name: str) -> bool:
+        return bool(
+            self.connection.execute(
+                "SELECT 1 FROM report WHERE name = ? AND expires > ?",
+                (name, time.time()),
+            ).fetchone()
+        )
+
+    def load_host(self, name: str, host: str) -> Optional[HostResult]:
+        if not self.__alive(name):
+            return super().load_host(name, host)
+        hosts = self.__hosts(name, "AND host = ?", (host,))
+        return hosts[0] if hosts else None
+
+    @staticmethod
+    def __condition(
+        host: Optional[str],
+        oid: Optional[str],
+        threat: Optional[str],
+        min_severity: Optional[float],
+    ):
+        conditions = []
+        parameter = []
+        if host is not None:
+            conditions.append(
+                "AND result.host IN (SELECT position FROM host"
+                " WHERE host.report = result.report AND host.host = ?)"
+            )
+            parameter.append(host)
+        for column, value, operator in (
+            ("oid", oid, "="),
+            ("threat", threat, "="),
+            ("severity", min_severity, ">="),
+        ):
+            if value is not None:
+                conditions.append(f"AND result.{column} {operator} ?")
+                parameter.append(value)
+        return " ".join(conditions), tuple(parameter)
+
+    def load_results(
+        self,
+        name: str,
+        *,
+        host: Optional[str] = None,
+        oid: Optional[str] = None,
+        threat: Optional[str] = None,
+        min_severity: Optional[float] = None,
+    ) -> List[Result]:
+        if not self.__alive(name):
+            return super().load_results(
+                name,
+                host=host,
+                oid=oid,
+                threat=threat,
+                min_severity=min_severity,
+            )
+        condition, parameter = self.__condition(host, oid, threat, min_severity)
+        per_host = self.__results(name, condition, parameter)
+        return [
+            result
+            for position in sorted(per_host)
+            for result in per_host[position]
+        ]
+
+    def count_results(self, name: str, **criteria) -> int:
+        if not self.__alive(name):
+            return super().count_results(name, **criteria)
+        condition, parameter = self.__condition(
+            criteria.get("host"),
+            criteria.get("oid"),
+            criteria.get("threat"),
+            criteria.get("min_severity"),
+        )
+        return self.connection.execute(
+            f"SELECT count(*) FROM result WHERE result.report = ? {condition}",
+            (name, *parameter),
+        ).fetchone()[0]
+
+
+__lock = threading.Lock()
+__backends: Dict[str, StorageBackend] = {}
+
+
+def backend() -> StorageBackend:
+    """
+    returns the StorageBackend configured by PHEME_STORAGE_BACKEND.
+    """
+    with __lock:
+        if "default" not in __backends:
+            if settings.STORAGE_BACKEND == "redis":
+                __backends["default"] = RedisBackend(settings.REDIS_URL)
+            elif settings.STORAGE_BACKEND == "sqlite":
+                __backends["default"] = SQLiteBackend()
+            elif settings.STORAGE_BACKEND == "django":
+                __backends["default"] = DjangoCacheBackend()
+            else:
+                raise ImproperlyConfigured(
+                    f"Unknown storage backend {settings.STORAGE_BACKEND}"
+                )
+        return __backends["default"]
 
 
 def __default_store_handler(name: str, value: Dict):
-    cache.set(name, value)
+    if _is_indexable(value):
+        backend().store_report(name, value)
+    else:
+        backend().store(name, value)
 
 
 def __default_load_handler(name: str) -> Dict:
-    return cache.get(name)
+    return backend().load(name)
 
 
 def __default_id_generator(prefix: str) -> str:
@@ -50,3 +1264,89 @@ def store(
         value["internal_name"] = name
     handler(name, value)
     return name
+
+
+def update_report(name: str, report: Dict):
+    """
+    stores the report name whose results are ChangedHosts; just the changed
+    hosts and the header are stored again.
+    """
+    backend().update_report(name, report)
+
+
+def __reference_key(key: str) -> str:
+    return f"reference/{key}"
+
+
+def reference(key: str) -> Optional[str]:
+    """
+    returns the name stored for key and adds a reference to it or None when
+    there is no name for key anymore.
+
+    The expiry of the name is refreshed so that it is available as long as a
+    newly stored copy would be.
+    """
+    storage = backend()
+    entry = storage.load(__reference_key(key))
+    if not entry or not storage.touch_report(entry["name"]):
+        return None
+    entry["references"] += 1
+    storage.store(__reference_key(key), entry)
+    storage.touch(f"{entry['name']}-reference")
+    return entry["name"]
+
+
+def add_reference(key: str, name: str):
+    """
+    stores name for key so that it can be referenced by reference(key).
+    """
+    backend().store_many(
+        {
+            __reference_key(key): {"name": name, "references": 1},
+            f"{name}-reference": key,
+        }
+    )
+
+
+def release(name: str) -> int:
+    """
+    removes a reference to name before it gets modified and returns the amount
+    of remaining references.
+
+    When there are remaining references name is still referenced by its key
+    and must not be modified; otherwise it is not referenced anymore.
+    """
+    storage = backend()
+    key = storage.load(f"{name}-reference")
+    entry = storage.load(__reference_key(key)) if key else None
+    if not entry or entry["name"] != name:
+        return 0
+    entry["references"] -= 1
+    if entry["references"] > 0:
+        storage.store(__reference_key(key), entry)
+        return entry["references"]
+    storage.delete(__reference_key(key), f"{name}-reference")
+    return 0
+
+
+def load_host(name: str, host: str) -> Optional[HostResult]:
+    """
+    returns the results of a host within the report stored as name.
+    """
+    return backend().load_host(name, host)
+
+
+def load_results(name: str, **criteria) -> List[Result]:
+    """
+    returns the results of the report stored as name matching criteria; see
+    StorageBackend.load_results.
+    """
+    return backend().load_results(name, **criteria)
+
+
+def count_results(name: str, **criteria) -> int:
+    """
+    returns the amount of results of the report stored as name matching
+    criteria; see StorageBackend.load_results.
+    """
+    return backend().count_results(name, **criteria)
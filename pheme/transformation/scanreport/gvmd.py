@@ -26,20 +26,59 @@ contrains the function
 it is a specialized module for gvmd scanreports.
 """
 
+import heapq
 import logging
+import sys
 import time
-from typing import Dict, List, Optional
+import zlib
+from array import array
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
+from pheme import settings
+from pheme.parser.xml import ReportStream
 from pheme.transformation.scanreport.model import (
+    CountGraph,
+    HostResult,
+    Note,
+    NVTCount,
+    NVTResult,
+    Occurrence,
+    OSCount,
+    Override,
     # Equipment,
     Overview,
+    PortCount,
     Report,
+    Result,
+    SeverityCount,
+    shallow_asdict,
 )
 
 logger = logging.getLogger(__name__)
 
+# key of the host overview entry combining the hosts not within the top hosts
+OTHERS = "others"
+
 __threats = ["Critical", "High", "Medium", "Low"]
 __threat_index_lookup = {v: i for i, v in enumerate(__threats)}
+# tags with just a few different values within a report
+__low_cardinality_tags = {"solution_type", "solution_method", "qod_type"}
 
 
 def measure_time(func):
@@ -64,7 +103,7 @@ def __group_refs(refs: Dict[str, str]) -> Dict:
     for ref in refs.get("ref", []):
         if isinstance(ref, dict):
             typus = ref.get("type", "unknown")
-            refs_ref[typus] = refs_ref.get(typus, []) + [ref.get("id")]
+            refs_ref.setdefault(typus, []).append(ref.get("id"))
     return refs_ref
 
 
@@ -87,6 +126,56 @@ def __get_hostname_from_result(result) -> str:
     return ""
 
 
+def __new_columns() -> Dict[str, array]:
+    """
+    creates the columns containing host index, threat index and severity
+    bucket of each result; -1 marks an unknown threat or a severity without
+    a bucket.
+    """
+    return {"host": array("q"), "threat": array("b"), "severity": array("b")}
+
+
+def __aggregate_columns(
+    columns: Dict[str, array], amount_of_hosts: int
+) -> Tuple[List[List[int]], List[List[int]]]:
+    """
+    counts the threats and severity buckets per host in one batched pass over
+    the columns; uses numpy when it is installed.
+
+    Returns a threat matrix and a severity histogram with a row per host.
+    """
+    threat_buckets = len(__threats)
+    if numpy is not None:
+        hosts = numpy.frombuffer(columns["host"], dtype=numpy.int64)
+
+        def count(column: array, buckets: int) -> List[List[int]]:
+            values = numpy.frombuffer(column, dtype=numpy.int8)
+            valid = values >= 0
+            return (
+                numpy.bincount(
+                    hosts[valid] * buckets + values[valid],
+                    minlength=amount_of_hosts * buckets,
+                )
+                .reshape(amount_of_hosts, buckets)
+                .tolist()
+            )
+
+        return (
+            count(columns["threat"], threat_buckets),
+            count(columns["severity"], 10),
+        )
+    threat_matrix = [[0] * threat_buckets for _ in range(amount_of_hosts)]
+    severity_matrix = [[0] * 10 for _ in range(amount_of_hosts)]
+    for host, threat, severity in zip(
+        columns["host"], columns["threat"], columns["severity"]
+    ):
+        if threat >= 0:
+            threat_matrix[host][threat] += 1
+        if severity >= 0:
+            severity_matrix[host][severity] += 1
+    return threat_matrix, severity_matrix
+
+
 def __return_highest_threat(threats: List[int]) -> str:
     """
     returns the highest threat
@@ -127,59 +216,38 @@ def __host_severity_overview(nvt_count: List[int]) -> Dict:
     return result
 
 
-def __create_host_information_lookup(report: Dict) -> Dict:
+def __get_host_information(host: Dict) -> Dict:
     """
-    created a lookup table for available host information
+    filters the available host information of a gvmd host
     """
     # lookup for host information name and dict name
     information_key = {"best_os_txt": "os", "hostname": "hostname"}
-
-    def filter_per_host(host: Dict) -> Dict:
-        information = {}
-        found = 0
-
-        def check_host_detail(detail: Dict) -> int:
-            name = detail.get("name", "")
-            if name in information_key:
-                information[information_key.get(name)] = detail.get("value")
-                return 1
-            return 0
-
-        details = host.get("detail", [])
-        if isinstance(details, dict):
-            check_host_detail(details)
-            return information
-        elif isinstance(details, list):
-            for detail in details:
-                found += check_host_detail(detail)
-                if found == len(information_key):
-                    return information
-            return information
-        else:
-            return information
-
-    def get_result_key(host, hostname):
-        ip = host.get("ip", "unknown")
-        if ip.startswith("sha256:") and len(hostname) > 0:
-            return ip + "##" + hostname
-        else:
-            return ip
-
-    result = {}
-    hosts = report.get("host")
-    if isinstance(hosts, dict):
-        information = filter_per_host(hosts)
-        result[get_result_key(hosts, information.get("hostname", ""))] = (
-            information
-        )
-    elif isinstance(hosts, list):
-        # best_os_txt seems to be in the end
-        for host in hosts[::-1]:
-            information = filter_per_host(host)
-            result[get_result_key(host, information.get("hostname", ""))] = (
-                information
-            )
-    return result
+    information = {}
+    found = 0
+
+    def check_host_detail(detail: Dict) -> int:
+        name = detail.get("name", "")
+        if name in information_key:
+            information[information_key.get(name)] = detail.get("value")
+            return 1
+        return 0
+
+    details = host.get("detail", [])
+    if isinstance(details, dict):
+        check_host_detail(details)
+    elif isinstance(details, list):
+        for detail in details:
+            found += check_host_detail(detail)
+            if found == len(information_key):
+                return information
+    return information
+
+
+def __get_host_information_key(host: Dict, hostname: str) -> str:
+    ip = host.get("ip", "unknown")
+    if ip.startswith("sha256:") and len(hostname) > 0:
+        return ip + "##" + hostname
+    return ip
 
 
 def __is_container_image_report(report: Dict) -> bool:
@@ -200,261 +268,820 @@ def __is_container_image_report(report: Dict) -> bool:
     return False
 
 
-@measure_time
-def __create_results_per_host(
-    report: Dict, is_container_image_report: bool
-) -> List[Dict]:
+def __is_used_detail(detail: Dict) -> bool:
+    return detail.get("name", "hostname") in ("best_os_txt", "hostname")
+
+
+# the elements of a gvmd report used by the transformation; everything else
+# is skipped while parsing a ReportStream
+PROJECTION = {
+    # usually an attribute of the report
+    "id": None,
+    "task": {"name": None, "comment": None},
+    "scan_start": None,
+    "results": {
+        "result": {
+            "host": None,
+            "port": None,
+            "threat": None,
+            "severity": None,
+            "description": None,
+            "nvt": None,
+            "qod": None,
+            "notes": None,
+            "overrides": None,
+            "oci_image": None,
+        }
+    },
+    "host": {
+        "ip": None,
+        "detail": ({"name": None, "value": None}, __is_used_detail),
+    },
+}
+
+
+def result_filter(
+    min_severity: Optional[float] = None,
+    min_qod: Optional[int] = None,
+    threats: Optional[Iterable[str]] = None,
+    exclude_families: Optional[Iterable[str]] = None,
+) -> Optional[Callable[[Dict], bool]]:
     """
-    creates the results dict used by a vulnerability-report based on a given
-    gvmd report.
+    returns a function deciding if a gvmd result is kept or None when there
+    is nothing to filter.
+
+    The function just checks the fields contained in a result so that a
+    ReportStream can use it to drop a result while it is parsed.
+    """
+    if (
+        min_severity is None
+        and min_qod is None
+        and not threats
+        and not exclude_families
+    ):
+        return None
+    threats = set(threats) if threats else None
+    exclude_families = set(exclude_families or ())
+
+    def accepts(result: Dict) -> bool:
+        if threats is not None and "threat" in result:
+            if result["threat"] not in threats:
+                return False
+        if min_severity is not None and "severity" in result:
+            if float(result["severity"] or 0) < min_severity:
+                return False
+        qod = result.get("qod")
+        if min_qod is not None and isinstance(qod, dict) and "value" in qod:
+            if int(qod["value"] or 0) < min_qod:
+                return False
+        nvt = result.get("nvt")
+        if exclude_families and isinstance(nvt, dict):
+            if nvt.get("family") in exclude_families:
+                return False
+        return True
+
+    return accepts
+
+
+def __as_items(
+    report: Dict, result_filter: Optional[Callable[[Dict], bool]] = None
+) -> Iterator[Tuple[str, Dict]]:
+    """
+    yields the results and hosts of a parsed gvmd report the same way a
+    ReportStream does.
     """
-    host_information_lookup = __create_host_information_lookup(report)
     results = report.get("results", {}).get("result", [])
     hosts = report.get("host", [])
-    by_host = {}
-    host_threat_count = {}
-    host_severity_count = {}
-    threat_count = [0] * len(__threats)
-
-    def transform_key(prefix: str, vic: Dict) -> Dict:
-        return {f"{prefix}_{key}": value for key, value in vic.items()}
-
-    def shorten(s, n=28):
-        s = s or ""
-        return s if len(s) < n else s[: n - 3] + "..."
-
-    def split_image_name(hostname: str) -> str:
-        if "/" in hostname:
-            return hostname.split("/")[-1]
-        return hostname
-
-    def per_result(result):
-        host_ip = __get_host_ip_from_result(result)
-        hostname = __get_hostname_from_result(result)
-        oci_image = transform_key("oci_image", result.get("oci_image", {}))
-        if oci_image.get("oci_image_short_name") is not None:
-            oci_image["oci_image_short_name"] = shorten(
-                oci_image.get("oci_image_short_name", ""), 60
+    # lists with just one element can be parsed as dict by xmltodict
+    if isinstance(results, dict):
+        results = [results]
+    for result in results:
+        if result_filter is None or result_filter(result):
+            yield "result", result
+    if isinstance(hosts, dict):
+        yield "host", hosts
+    elif isinstance(hosts, list):
+        for host in hosts:
+            yield "host", host
+
+
+def __transform_key(prefix: str, vic: Dict) -> Dict:
+    return {f"{prefix}_{key}": value for key, value in vic.items()}
+
+
+def __shorten(s, n=28):
+    s = s or ""
+    return s if len(s) < n else s[: n - 3] + "..."
+
+
+def __split_image_name(hostname: str) -> str:
+    if "/" in hostname:
+        return hostname.split("/")[-1]
+    return hostname
+
+
+def __transform_text(text) -> Tuple[str, str]:
+    """
+    returns text and excerpt of a note or override text
+    """
+    if isinstance(text, dict):
+        return text.get("text", ""), text.get("excerpt", "0")
+    return text, "0"
+
+
+def __transform_note(note: Dict) -> Note:
+    text, excerpt = __transform_text(note["text"])
+    return Note(text, excerpt)
+
+
+def __transform_override(override: Dict) -> Override:
+    severity = override["severity"]
+    severity_description = severity
+    if not severity:
+        severity_description = "Any severity"
+    elif float(severity) == 0.0:
+        severity_description = "Log"
+    elif float(severity) > 0.0:
+        severity_description = "Any positive severity"
+
+    text, excerpt = __transform_text(override["text"])
+    return Override(
+        text,
+        excerpt,
+        severity,
+        severity_description,
+        override["new_severity"],
+    )
+
+
+def __as_list(value) -> List:
+    # lists with just one element can be parsed as dict by xmltodict
+    return [value] if isinstance(value, dict) else value
+
+
+def __new_accumulation(is_container_image_report: Optional[bool]) -> Dict:
+    """
+    creates the state used to accumulate the results and hosts of a report
+
+    When is_container_image_report is None it gets decided on the first result
+    or host, since a streamed report only reveals its hosts after its results.
+    """
+    return {
+        "is_container_image_report": is_container_image_report,
+        "by_host": {},
+        "host_keys": [],
+        "columns": __new_columns(),
+        "host_information": {},
+        "host_hostnames": [],
+        "nvts": {},
+        "qods": {},
+        "values": {},
+        "deduplicated": 0,
+    }
+
+
+def __new_host(host_ip: str, index: int) -> Dict:
+    return {
+        "host": host_ip,
+        # the row of the host within the aggregated columns
+        "index": index,
+        "hostname": "",
+        "hostnames": [],
+        "known_hostnames": set(),
+        "oci_image": {},
+        "ports": set(),
+        # equipment ports of a host are a set when the last result of the host
+        # contained a port and a list otherwise
+        "ports_as_set": False,
+        # the oids and names of the NVTs found on the host
+        "nvts": {},
+        "results": [],
+    }
+
+
+def __dedup(accumulation: Dict, value):
+    """
+    returns the first seen equal value instead of value.
+
+    Values like threats, ports, hostnames or operating systems are repeated
+    throughout a report but are created as separate objects by the parser.
+    """
+    values = accumulation["values"]
+    existing = values.setdefault(value, value)
+    if existing is not value:
+        accumulation["deduplicated"] += sys.getsizeof(value)
+    return existing
+
+
+def __transform_nvt(accumulation: Dict, nvt: Dict) -> Dict:
+    """
+    returns the nvt fields of a result.
+
+    The same NVT is usually found on many hosts, therefore the fields are
+    computed once per OID and shared between the results as long as the NVT
+    content is the same. The shared values must not be modified.
+    """
+    nvts = accumulation["nvts"]
+    oid = nvt.get("oid")
+    cached = nvts.get(oid)
+    if cached is not None and cached[0] == nvt:
+        return cached[1]
+    fields = __transform_key("nvt", nvt)
+    if "nvt_family" in fields:
+        fields["nvt_family"] = __dedup(accumulation, fields["nvt_family"])
+    solution = fields.get("nvt_solution")
+    if isinstance(solution, dict) and "type" in solution:
+        solution["type"] = __dedup(accumulation, solution["type"])
+    tags = __tansform_tags(fields.get("nvt_tags", ""))
+    if tags:
+        tags = {
+            __dedup(accumulation, key): (
+                __dedup(accumulation, value)
+                if key in __low_cardinality_tags
+                else value
             )
-        key = (
-            host_ip + "##" + hostname
-            if is_container_image_report and len(hostname) > 0
-            else host_ip
-        )
-        host_dict = by_host.get(key, {})
-        threat = result.get("threat", "unknown")
-        port = result.get("port")
-        nvt = transform_key("nvt", result.get("nvt", {}))
-        nvt["nvt_tags_interpreted"] = __tansform_tags(nvt.get("nvt_tags", ""))
-        nvt["nvt_refs_ref"] = __group_refs(nvt.get("nvt_refs", {}))
-        qod = transform_key("qod", result.get("qod", {}))
-        severity = float(result.get("severity", "0.0"))
-        notes = result.get("notes", {}).get("note", [])
-        overrides = result.get("overrides", {}).get("override", [])
-
-        new_host_result = {
-            "hostname": hostname,
-            "port": port,
-            "threat": threat,
-            "severity": severity,
-            "description": result.get("description"),
-            **nvt,
-            **qod,
-            "notes": [],
-            "overrides": [],
+            for key, value in tags.items()
         }
-        host_results = host_dict.get("results", [])
-        host_results.append(new_host_result)
-        hostnames = host_dict.get("hostnames", [])
-        if hostname is not None and hostname not in hostnames:
-            hostnames.append(hostname)
-        equipment = host_dict.get("equipment", {})
-        ports = list(dict.fromkeys(equipment.get("ports", [])))
-        if port and not port.startswith("general"):
-            ports = set(ports + [port])
-        equipment["ports"] = ports
-        if not equipment.get("os"):
-            equipment["os"] = host_information_lookup.get(key, {}).get(
-                "os", "unknown"
-            )
+    fields["nvt_tags_interpreted"] = tags
+    fields["nvt_refs_ref"] = __group_refs(fields.get("nvt_refs", {}))
+    nvts[oid] = (nvt, fields)
+    return fields
 
-        # needs host_ip, high, medium, low
-        host_threats = host_threat_count.get(
-            key, {threat: 0 for threat in __threats}
-        )
-        threat_index = __threat_index_lookup.get(threat)
-        if threat_index is not None:
-            threat_count[threat_index] += 1
-        if host_threats.get(threat) is not None:
-            host_threats[threat] += 1
-        host_threat_count[key] = host_threats
-
-        # needs high, medium, low
-
-        # severity 1 to 10
-        host_severities = host_severity_count.get(key, [0] * 10)
-        if severity > 0:
-            host_severities[int(severity) - 1] += 1
-        host_severity_count[key] = host_severities
-
-        def per_note(note):
-            result_notes = new_host_result.get("notes", [])
-            text = ""
-            excerpt = "0"
-            if isinstance(note["text"], dict):
-                if "text" in note["text"]:
-                    text = note["text"]["text"]
-                if "excerpt" in note["text"]:
-                    excerpt = note["text"]["excerpt"]
-            else:
-                text = note["text"]
-
-            new_note = {
-                "text": text,
-                "text_excerpt": excerpt,
-            }
-            result_notes.append(new_note)
-
-        def per_override(override):
-            result_overrides = new_host_result.get("overrides", [])
-            severity = override["severity"]
-            severity_description = severity
-            if not severity:
-                severity_description = "Any severity"
-            elif float(severity) == 0.0:
-                severity_description = "Log"
-            elif float(severity) > 0.0:
-                severity_description = "Any positive severity"
-
-            text = ""
-            excerpt = "0"
-            if isinstance(override["text"], dict):
-                if "text" in override["text"]:
-                    text = override["text"]["text"]
-                if "excerpt" in override["text"]:
-                    excerpt = override["text"]["excerpt"]
-            else:
-                text = override["text"]
-
-            new_override = {
-                "text": text,
-                "text_excerpt": excerpt,
-                "severity": severity,
-                "severity_description": severity_description,
-                "new_severity": override["new_severity"],
-            }
-            result_overrides.append(new_override)
 
-        # lists with just one element can be parsed as dict by xmltodict
-        if isinstance(notes, dict):
-            per_note(notes)
-        else:
-            for note in notes:
-                per_note(note)
-
-        if isinstance(overrides, dict):
-            per_override(overrides)
-        else:
-            for override in overrides:
-                per_override(override)
-
-        by_host[key] = {
-            "host": host_ip,
-            "hostname": "",
-            "hostnames": hostnames,
-            **oci_image,
-            "threats": __host_threat_overview(host_threats),
-            "severities": __host_severity_overview(host_severities),
-            "equipment": equipment,
-            "results": host_results,
+def __transform_qod(accumulation: Dict, qod: Dict) -> Dict:
+    """
+    returns the qod fields of a result; there are just a few different ones
+    within a report so that they are shared between the results.
+    """
+    key = tuple(qod.items())
+    fields = accumulation["qods"].get(key)
+    if fields is None:
+        fields = accumulation["qods"][key] = {
+            f"qod_{name}": __dedup(accumulation, value)
+            for name, value in qod.items()
         }
+    return fields
 
-    def per_host(host):
-        host_ip = host.get("ip")
-        if host_ip not in by_host:
-            return
 
-        def per_detail(detail):
-            name = detail.get("name", "")
-            value = detail.get("value", "")
+def __get_result_key(
+    host_ip: str, hostname: str, is_container_image_report: bool
+) -> str:
+    return (
+        host_ip + "##" + hostname
+        if is_container_image_report and len(hostname) > 0
+        else host_ip
+    )
 
-            if name == "EXIT_CODE":
-                return
 
-            if name == "hostname" and by_host[host_ip]["hostname"] == "":
+def __accumulate_result(accumulation: Dict, result: Dict):
+    """
+    adds a gvmd result to its host; every update is done in constant time
+    so that the summaries of a host can be created once at the end.
+    """
+    host_ip = __get_host_ip_from_result(result)
+    hostname = __dedup(accumulation, __get_hostname_from_result(result))
+    if accumulation["is_container_image_report"] is None:
+        accumulation["is_container_image_report"] = host_ip.startswith(
+            "sha256:"
+        )
+    oci_image = __transform_key("oci_image", result.get("oci_image", {}))
+    if oci_image.get("oci_image_short_name") is not None:
+        oci_image["oci_image_short_name"] = __shorten(
+            oci_image.get("oci_image_short_name", ""), 60
+        )
+    key = __get_result_key(
+        host_ip, hostname, accumulation["is_container_image_report"]
+    )
+    by_host = accumulation["by_host"]
+    host = by_host.get(key)
+    if host is None:
+        host_keys = accumulation["host_keys"]
+        host = by_host[key] = __new_host(host_ip, len(host_keys))
+        host_keys.append(key)
+    threat = __dedup(accumulation, result.get("threat", "unknown"))
+    port = __dedup(accumulation, result.get("port"))
+    nvt = __transform_nvt(accumulation, result.get("nvt", {}))
+    qod = __transform_qod(accumulation, result.get("qod", {}))
+    severity = float(result.get("severity", "0.0"))
+    notes = __as_list(result.get("notes", {}).get("note", []))
+    overrides = __as_list(result.get("overrides", {}).get("override", []))
+
+    host["results"].append(
+        Result(
+            hostname,
+            port,
+            threat,
+            severity,
+            result.get("description"),
+            nvt,
+            qod,
+            [__transform_note(note) for note in notes],
+            [__transform_override(override) for override in overrides],
+        )
+    )
+    if hostname is not None and hostname not in host["known_hostnames"]:
+        host["known_hostnames"].add(hostname)
+        host["hostnames"].append(hostname)
+    host["nvts"].setdefault(nvt.get("nvt_oid"), nvt.get("nvt_name"))
+    host["oci_image"] = oci_image
+    host["ports_as_set"] = bool(port) and not port.startswith("general")
+    if host["ports_as_set"]:
+        host["ports"].add(port)
+
+    columns = accumulation["columns"]
+    columns["host"].append(host["index"])
+    columns["threat"].append(__threat_index_lookup.get(threat, -1))
+    # severity 1 to 10; severities below 1 are counted as 10 like the former
+    # list index -1 did
+    columns["severity"].append(
+        (min(int(severity), 10) - 1) % 10 if severity > 0 else -1
+    )
+
+
+def __accumulate_host(accumulation: Dict, host: Dict):
+    """
+    keeps the information of a gvmd host until all results are known.
+    """
+    if accumulation["is_container_image_report"] is None:
+        accumulation["is_container_image_report"] = host.get(
+            "ip", ""
+        ).startswith("sha256:")
+    information = __get_host_information(host)
+    if "os" in information:
+        information["os"] = __dedup(accumulation, information["os"])
+    # the first occurrence of a host contains the relevant information
+    accumulation["host_information"].setdefault(
+        __get_host_information_key(host, information.get("hostname", "")),
+        information,
+    )
+    details = __as_list(host.get("detail", []))
+    # just keep the hostnames instead of all details until the end
+    accumulation["host_hostnames"].append(
+        (
+            host.get("ip"),
+            [
+                detail.get("value", "")
+                for detail in details
+                if detail.get("name", "") == "hostname"
+            ],
+        )
+    )
+
+
+def __apply_host_hostnames(accumulation: Dict):
+    by_host = accumulation["by_host"]
+    is_container_image_report = accumulation["is_container_image_report"]
+    for host_ip, hostnames in accumulation["host_hostnames"]:
+        if host_ip not in by_host:
+            continue
+        for value in hostnames:
+            if by_host[host_ip]["hostname"] == "":
                 if is_container_image_report and len(value) > 0:
                     key = host_ip + "##" + value
                 else:
                     key = host_ip
                 by_host[key]["hostname"] = value
 
-        details = host.get("detail", [])
-        if isinstance(details, dict):
-            per_detail(details)
-        else:
-            for detail in details:
-                per_detail(detail)
 
-    # lists with just one element can be parsed as dict by xmltodict
-    if isinstance(results, dict):
-        per_result(results)
-    else:
-        for result in results:
-            per_result(result)
+def __finish_host(
+    key: str,
+    host: Dict,
+    host_information: Dict,
+    threats: Dict[str, int],
+    severities: List[int],
+) -> HostResult:
+    ports = host["ports"]
+    return HostResult(
+        host["host"],
+        host["hostname"],
+        host["hostnames"],
+        host["oci_image"],
+        __host_threat_overview(threats),
+        __host_severity_overview(severities),
+        {
+            "ports": ports if host["ports_as_set"] else list(ports),
+            "os": host_information.get(key, {}).get("os", "unknown"),
+        },
+        host["results"],
+    )
 
-    if isinstance(hosts, dict):
-        per_host(hosts)
-    elif isinstance(hosts, list):
-        for host in hosts:
-            per_host(host)
 
-    threat_count_dict = {
-        __threats[i]: count for i, count in enumerate(threat_count)
+def __top_hosts(
+    host_threat_count: List[Tuple[str, Dict[str, int]]],
+    limit: Optional[int] = None,
+) -> Dict[str, Dict[str, int]]:
+    """
+    returns the hosts sorted by amount of threats descending.
+
+    When there are more than limit hosts only the top limit hosts are kept and
+    the threats of the remaining hosts are summed up within an others entry.
+    """
+
+    def total(index: int) -> int:
+        return sum(host_threat_count[index][1].values())
+
+    indices = range(len(host_threat_count))
+    if limit is None or len(host_threat_count) <= limit:
+        return dict(
+            host_threat_count[i]
+            for i in sorted(indices, key=total, reverse=True)
+        )
+    top = heapq.nlargest(max(limit, 0), indices, key=total)
+    selected = set(top)
+    others = dict.fromkeys(__threats, 0)
+    for index in indices:
+        if index not in selected:
+            for threat, amount in host_threat_count[index][1].items():
+                others[threat] += amount
+    host_threats = dict(host_threat_count[i] for i in top)
+    host_threats[OTHERS] = others
+    return host_threats
+
+
+def __most_common(
+    counter: Counter, limit: Optional[int] = None
+) -> List[Tuple[str, int]]:
+    """
+    returns the limit most common elements of counter; elements with the same
+    count are ordered by their key so that the order does not depend on the
+    order of sets.
+    """
+
+    def order(element: Tuple[str, int]) -> Tuple[int, str]:
+        return -element[1], str(element[0])
+
+    if limit is None:
+        return sorted(counter.items(), key=order)
+    return heapq.nsmallest(max(limit, 0), counter.items(), key=order)
+
+
+def __overview_graphs(
+    by_host: Dict,
+    results: List[HostResult],
+    severity_matrix: List[List[int]],
+    nvt_limit: Optional[int] = None,
+) -> Dict[str, CountGraph]:
+    """
+    returns the top NVTs by affected hosts, the operating system and port
+    distribution of the vulnerable hosts and the severity histogram of the
+    results so that templates do not need to loop over the results.
+    """
+    hosts_per_nvt = Counter()
+    nvt_names = {}
+    hosts_per_port = Counter()
+    for host in by_host.values():
+        hosts_per_nvt.update(host["nvts"].keys())
+        nvt_names.update(host["nvts"])
+        hosts_per_port.update(host["ports"])
+    hosts_per_os = Counter(host["equipment"]["os"] for host in results)
+    severities = [sum(column) for column in zip(*severity_matrix)]
+    return {
+        "vulnerable_equipment": CountGraph(
+            "vulnerable_equipment",
+            None,
+            [OSCount(os, amount) for os, amount in __most_common(hosts_per_os)],
+        ),
+        "top_nvts": CountGraph(
+            "top_nvts",
+            None,
+            [
+                NVTCount(oid, amount, nvt_names[oid])
+                for oid, amount in __most_common(hosts_per_nvt, nvt_limit)
+            ],
+        ),
+        "ports": CountGraph(
+            "ports",
+            None,
+            [
+                PortCount(port, amount)
+                for port, amount in __most_common(hosts_per_port)
+            ],
+        ),
+        "severities": CountGraph(
+            "severities",
+            None,
+            [
+                SeverityCount(str(i + 1), amount)
+                for i, amount in enumerate(severities)
+            ],
+        ),
     }
 
-    is_combined_key = all("##" in key for key in host_threat_count.keys())
 
+def __host_overview(
+    host_threats: Dict[str, Dict[str, int]],
+    is_container_image_report: bool,
+    host_limit: Optional[int] = None,
+) -> Dict[str, Dict[str, int]]:
+    host_threat_count = list(host_threats.items())
+    is_combined_key = all("##" in key for key in host_threats.keys())
     if is_container_image_report and is_combined_key:
-        results = map(
-            lambda item: (
-                shorten(split_image_name(item[0].split("##")[-1])),
-                item[1],
-            ),
-            host_threat_count.items(),
-        )
-    else:
-        results = host_threat_count.items()
-
-    # sort by amount descending
-    host_threat_count = dict(
-        sorted(
-            results,
-            key=lambda x: sum(x[1].values()),
-            reverse=True,
+        host_threat_count = [
+            (__shorten(__split_image_name(key.split("##")[-1])), threats)
+            for key, threats in host_threat_count
+        ]
+    return __top_hosts(host_threat_count, host_limit)
+
+
+def __finish_accumulation(
+    accumulation: Dict,
+    host_limit: Optional[int] = None,
+    nvt_limit: Optional[int] = None,
+) -> Tuple:
+    # hosts are following the results within a gvmd report therefore the host
+    # information can only be applied afterwards
+    __apply_host_hostnames(accumulation)
+    logger.info(
+        "deduplicating %s distinct values saved %s bytes",
+        len(accumulation["values"]),
+        accumulation["deduplicated"],
+    )
+    by_host = accumulation["by_host"]
+    is_container_image_report = bool(accumulation["is_container_image_report"])
+    threat_matrix, severity_matrix = __aggregate_columns(
+        accumulation["columns"], len(accumulation["host_keys"])
+    )
+    host_threats = {
+        key: dict(zip(__threats, threat_matrix[host["index"]]))
+        for key, host in by_host.items()
+    }
+    results = [
+        __finish_host(
+            key,
+            host,
+            accumulation["host_information"],
+            host_threats[key],
+            severity_matrix[host["index"]],
         )
+        for key, host in by_host.items()
+    ]
+    threat_count_dict = {
+        threat: sum(row[i] for row in threat_matrix)
+        for i, threat in enumerate(__threats)
+    }
+
+    return (
+        results,
+        __host_overview(host_threats, is_container_image_report, host_limit),
+        threat_count_dict,
+        is_container_image_report,
+        __overview_graphs(by_host, results, severity_matrix, nvt_limit),
     )
 
-    return list(by_host.values()), host_threat_count, threat_count_dict
+
+def __accumulate_batch(
+    is_container_image_report: bool, results: List[Dict]
+) -> Dict:
+    """
+    accumulates a batch of results within a worker process
+    """
+    accumulation = __new_accumulation(is_container_image_report)
+    for result in results:
+        __accumulate_result(accumulation, result)
+    return {
+        "by_host": accumulation["by_host"],
+        "columns": accumulation["columns"],
+        "deduplicated": accumulation["deduplicated"],
+    }
+
+
+def __merge_accumulation(accumulation: Dict, batch: Dict):
+    """
+    merges the hosts and counter of a batch into the accumulation.
+
+    The batch must contain the results following the already accumulated
+    results of its hosts.
+    """
+    by_host = accumulation["by_host"]
+    host_keys = accumulation["host_keys"]
+    # maps the host indices of the batch to the ones of the accumulation
+    indices = [0] * len(batch["by_host"])
+    for key, host in batch["by_host"].items():
+        existing = by_host.get(key)
+        if existing is None:
+            indices[host["index"]] = host["index"] = len(host_keys)
+            host_keys.append(key)
+            by_host[key] = host
+            continue
+        indices[host["index"]] = existing["index"]
+        existing["results"].extend(host["results"])
+        for hostname in host["hostnames"]:
+            if hostname not in existing["known_hostnames"]:
+                existing["known_hostnames"].add(hostname)
+                existing["hostnames"].append(hostname)
+        for oid, name in host["nvts"].items():
+            existing["nvts"].setdefault(oid, name)
+        existing["oci_image"] = host["oci_image"]
+        existing["ports"].update(host["ports"])
+        existing["ports_as_set"] = host["ports_as_set"]
+    columns = accumulation["columns"]
+    columns["host"].extend(indices[i] for i in batch["columns"]["host"])
+    columns["threat"].extend(batch["columns"]["threat"])
+    columns["severity"].extend(batch["columns"]["severity"])
+    accumulation["deduplicated"] += batch["deduplicated"]
+
+
+def __accumulate_in_parallel(
+    accumulation: Dict,
+    items: Iterator[Tuple[str, Dict]],
+    workers: int,
+    batch_size: int = 2000,
+):
+    """
+    accumulates the remaining results of items within worker processes.
+
+    The results are partitioned by host so that all results of a host are
+    processed by the same shard in their original order. The batches are
+    merged in the order they were submitted and the hosts are kept in the
+    order of their first result; therefore the outcome is the same as when
+    accumulating sequentially.
+    """
+    is_container_image_report = bool(accumulation["is_container_image_report"])
+    by_host = accumulation["by_host"]
+    order = dict.fromkeys(by_host)
+    shards = [[] for _ in range(workers)]
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+
+        def submit(shard: int):
+            pending.append(
+                executor.submit(
+                    __accumulate_batch,
+                    is_container_image_report,
+                    shards[shard],
+                )
+            )
+            shards[shard] = []
+            # limits the amount of results in flight
+            while len(pending) > workers * 2:
+                __merge_accumulation(accumulation, pending.popleft().result())
+
+        for kind, item in items:
+            if kind == "host":
+                __accumulate_host(accumulation, item)
+            elif kind == "result":
+                key = __get_result_key(
+                    __get_host_ip_from_result(item),
+                    __get_hostname_from_result(item),
+                    is_container_image_report,
+                )
+                order.setdefault(key)
+                shard = zlib.crc32(key.encode()) % workers
+                shards[shard].append(item)
+                if len(shards[shard]) >= batch_size:
+                    submit(shard)
+        for shard in range(workers):
+            if shards[shard]:
+                submit(shard)
+        while pending:
+            __merge_accumulation(accumulation, pending.popleft().result())
+    accumulation["by_host"] = {key: by_host[key] for key in order}
+
+
+@measure_time
+def __create_results_per_host(
+    items: Iterable[Tuple[str, Dict]],
+    is_container_image_report: Optional[bool] = None,
+    workers: int = 1,
+    parallel_threshold: int = 0,
+    host_limit: Optional[int] = None,
+    nvt_limit: Optional[int] = None,
+) -> Tuple:
+    """
+    creates the results dict used by a vulnerability-report based on the
+    results and hosts of a gvmd report.
+
+    When there are more than one workers the results after the first
+    parallel_threshold results are accumulated within worker processes.
+
+    When host_limit is set only the host_limit hosts with the most threats are
+    kept within the host overview, the others are combined. nvt_limit limits
+    the NVTs within the top NVTs overview in the same way.
+    """
+    accumulation = __new_accumulation(is_container_image_report)
+    amount = 0
+    items = iter(items)
+    for kind, item in items:
+        if kind == "result":
+            __accumulate_result(accumulation, item)
+            amount += 1
+            if workers > 1 and amount >= parallel_threshold:
+                __accumulate_in_parallel(accumulation, items, workers)
+        elif kind == "host":
+            __accumulate_host(accumulation, item)
+    return __finish_accumulation(accumulation, host_limit, nvt_limit)
+
+
+def __group_by_nvt(results: List[HostResult]) -> List[NVTResult]:
+    """
+    regroups the results of the hosts per NVT sorted by severity descending.
+
+    The nvt fields are shared between the results of a NVT already, so that
+    they are kept just once per NVT while each result is reduced to an
+    occurrence.
+    """
+    # pylint: disable=W0212
+    by_nvt = {}
+    for host in results:
+        for result in host.results:
+            oid = result._nvt.get("nvt_oid")
+            grouped = by_nvt.get(oid)
+            if grouped is None:
+                grouped = by_nvt[oid] = NVTResult(
+                    result._nvt,
+                    result.threat,
+                    result.severity,
+                    result.description,
+                    [],
+                )
+            elif result.severity > grouped.severity:
+                grouped.threat = result.threat
+                grouped.severity = result.severity
+            grouped.results.append(
+                Occurrence(
+                    host.host,
+                    result.hostname,
+                    result.port,
+                    result.threat,
+                    result.severity,
+                    None
+                    if result.description == grouped.description
+                    else result.description,
+                    result._qod,
+                    result.notes,
+                    result.overrides,
+                )
+            )
+    return sorted(by_nvt.values(), key=lambda x: x.severity, reverse=True)
 
 
 @measure_time
-def transform(data: Dict[str, str]) -> Report:
+def transform(
+    data: Union[Dict[str, str], ReportStream],
+    *,
+    workers: int = settings.TRANSFORM_WORKERS,
+    parallel_threshold: int = settings.TRANSFORM_PARALLEL_THRESHOLD,
+    host_limit: Optional[int] = None,
+    nvt_limit: Optional[int] = 10,
+    grouping: str = "host",
+    result_filter: Optional[Callable[[Dict], bool]] = None,
+) -> Report:
     """
-    transform will use the given dict of a scanreport from gvmd
+    transform will use the given dict or ReportStream of a scanreport from gvmd
     to create an easy to use data representation for visual reports.
+
+    Reports with more than parallel_threshold results are transformed by the
+    given amount of worker processes.
+
+    When host_limit is set the host overview contains the host_limit hosts with
+    the most threats and an others entry summing up the remaining hosts.
+
+    The overview contains the nvt_limit NVTs affecting the most hosts, the
+    distribution of operating systems and ports of the vulnerable hosts as
+    well as a severity histogram of all results.
+
+    With grouping nvt the results are grouped per NVT instead of per host.
+
+    Results for which result_filter returns False are skipped, see
+    result_filter().
     """
     if not data:
         raise ValueError("Need data to process")
-    report = data.get("report")
-    # sometimes gvmd reports have .report.report sometimes just .report
-    report = report.get("report", report)
-
-    task = report.get("task") or {}
+    if grouping not in ("host", "nvt"):
+        raise ValueError(f"Unknown grouping {grouping}")
     logger.info("data transformation")
-    is_container_image_scan = __is_container_image_report(report)
-    results, host_counts, nvts_counts = __create_results_per_host(
-        report, is_container_image_scan
+    if isinstance(data, ReportStream):
+        if result_filter is not None:
+            data.result_filter = result_filter
+        data.projection = PROJECTION
+        items = data
+        is_container_image_scan = None
+    else:
+        report = data.get("report")
+        # sometimes gvmd reports have .report.report sometimes just .report
+        report = report.get("report", report)
+        items = __as_items(report, result_filter)
+        is_container_image_scan = __is_container_image_report(report)
+    (
+        results,
+        host_counts,
+        nvts_counts,
+        is_container_image_scan,
+        graphs,
+    ) = __create_results_per_host(
+        items,
+        is_container_image_scan,
+        workers,
+        parallel_threshold,
+        host_limit,
+        nvt_limit,
     )
+    if isinstance(data, ReportStream):
+        report = data.header
+        if report is None:
+            raise ValueError("Need data to process")
+
+    task = report.get("task") or {}
 
     return Report(
         report.get("id"),
@@ -464,8 +1091,303 @@ def transform(data: Dict[str, str]) -> Report:
         Overview(
             hosts=host_counts,
             nvts=nvts_counts,
-            vulnerable_equipment=None,
             is_container_image_scan=is_container_image_scan,
+            **graphs,
         ),
+        __group_by_nvt(results) if grouping == "nvt" else results,
+        grouping,
+    )
+
+
+def __new_append_state(report: Dict) -> Dict:
+    """
+    creates the state needed to append results to a transformed report.
+
+    It contains the position, the threats, the details and the NVTs of each
+    host within the report as well as the amount of hosts per NVT, since the
+    top NVTs of the overview are limited, and the details of hosts which are
+    still waiting for their results.
+    """
+    is_container_image_report = report["overview"]["is_container_image_scan"]
+    hosts = {}
+    hosts_per_nvt = Counter()
+    nvt_names = {}
+    for index, host in enumerate(report["results"]):
+        results = host["results"]
+        hostname = (results[0].get("hostname") if results else None) or ""
+        nvts = {}
+        for result in results:
+            nvts.setdefault(result.get("nvt_oid"), result.get("nvt_name"))
+        hosts[
+            __get_result_key(host["host"], hostname, is_container_image_report)
+        ] = {
+            "index": index,
+            "threats": {
+                threat: host["threats"][threat] for threat in __threats
+            },
+            "os": host["equipment"]["os"],
+            "hostname": host["hostname"],
+            "nvts": set(nvts),
+        }
+        hosts_per_nvt.update(nvts.keys())
+        nvt_names.update(nvts)
+    return {
+        "hosts": hosts,
+        "hosts_per_nvt": hosts_per_nvt,
+        "nvt_names": nvt_names,
+        "host_information": {},
+        "host_hostnames": [],
+    }
+
+
+def __graph_counter(overview: Dict, name: str, key: str) -> Counter:
+    graph = overview.get(name) or {}
+    return Counter(
+        {count[key]: count["amount"] for count in graph.get("counts", [])}
+    )
+
+
+def __merge_host(
+    existing: Dict, host: HostResult, ports_as_set: bool
+) -> HostResult:
+    """
+    returns a host containing the results of existing followed by the ones of
+    host; the results of existing are extended in place.
+    """
+    threats = {
+        threat: existing["threats"].get(threat, 0) + host["threats"][threat]
+        for threat in __threats
+    }
+    severities = [
+        existing["severities"].get(str(i + 1), 0)
+        + host["severities"][str(i + 1)]
+        for i in range(10)
+    ]
+    hostnames = list(existing["hostnames"])
+    hostnames.extend(
+        hostname for hostname in host["hostnames"] if hostname not in hostnames
+    )
+    ports = set(existing["equipment"]["ports"])
+    ports.update(host["equipment"]["ports"])
+    os = existing["equipment"]["os"]
+    results = existing["results"]
+    results.extend(host["results"])
+    return HostResult(
+        existing["host"],
+        existing["hostname"] or host["hostname"],
+        hostnames,
+        {key: host[key] for key in host if key.startswith("oci_image")},
+        __host_threat_overview(threats),
+        __host_severity_overview(severities),
+        {
+            "ports": ports if ports_as_set else list(ports),
+            "os": host["equipment"]["os"] if os == "unknown" else os,
+        },
         results,
     )
+
+
+def __apply_host_details(
+    report: Dict, state: Dict, accumulation: Dict, hosts_per_os: Counter
+):
+    """
+    applies the operating system and hostname of hosts which are appended
+    without any results to the already known hosts.
+
+    The details of hosts without any results so far are kept within the state
+    until their results get appended.
+    """
+    hosts = state["hosts"]
+    by_host = accumulation["by_host"]
+    os_by_host = {}
+    state["host_information"] = {}
+    for key, information in accumulation["host_information"].items():
+        if key in by_host:
+            continue
+        if key in hosts:
+            os_by_host[key] = information.get("os", "unknown")
+        else:
+            state["host_information"][key] = information
+    hostname_by_host = {}
+    state["host_hostnames"] = []
+    for host_ip, hostnames in accumulation["host_hostnames"]:
+        if host_ip in by_host:
+            continue
+        if host_ip in hosts:
+            hostname_by_host.setdefault(
+                host_ip, next((value for value in hostnames if value), "")
+            )
+        else:
+            state["host_hostnames"].append((host_ip, hostnames))
+    for key in os_by_host.keys() | hostname_by_host.keys():
+        known = hosts[key]
+        os = known["os"]
+        if os == "unknown":
+            os = os_by_host.get(key, os)
+        hostname = known["hostname"] or hostname_by_host.get(key, "")
+        if os == known["os"] and hostname == known["hostname"]:
+            continue
+        hosts_per_os[known["os"]] -= 1
+        hosts_per_os[os] += 1
+        known["os"], known["hostname"] = os, hostname
+        index = known["index"]
+        existing = report["results"][index]
+        report["results"][index] = HostResult(
+            existing["host"],
+            hostname,
+            existing["hostnames"],
+            {
+                field: existing[field]
+                for field in existing
+                if field.startswith("oci_image")
+            },
+            existing["threats"],
+            existing["severities"],
+            {**existing["equipment"], "os": os},
+            existing["results"],
+        )
+
+
+@measure_time
+def append(
+    report: Dict,
+    data: Union[Dict[str, str], ReportStream],
+    state: Optional[Dict] = None,
+    *,
+    host_limit: Optional[int] = None,
+    nvt_limit: Optional[int] = 10,
+    result_filter: Optional[Callable[[Dict], bool]] = None,
+) -> Dict:
+    """
+    append adds the results and hosts of the given gvmd report to an already
+    transformed report and updates its overview in place.
+
+    The state is created out of the report when it is None, afterwards the
+    returned state should be kept for the next append so that the cost of an
+    append depends on the amount of new results instead of the whole report.
+    Only the hosts of the new results are accessed by their index within
+    the results of the report then, which can therefore be ChangedHosts.
+    """
+    if not data:
+        raise ValueError("Need data to process")
+    if report.get("grouping", "host") != "host":
+        raise ValueError("Only reports grouped by host can be appended")
+    if state is None:
+        state = __new_append_state(report)
+    if isinstance(data, ReportStream):
+        if result_filter is not None:
+            data.result_filter = result_filter
+        data.projection = PROJECTION
+        items = data
+    else:
+        items = data.get("report")
+        items = __as_items(items.get("report", items), result_filter)
+    overview = report["overview"]
+    accumulation = __new_accumulation(overview["is_container_image_scan"])
+    # host details of former appends which are still waiting for results
+    accumulation["host_information"].update(state.get("host_information", {}))
+    accumulation["host_hostnames"].extend(state.get("host_hostnames", []))
+    for kind, item in items:
+        if kind == "result":
+            __accumulate_result(accumulation, item)
+        elif kind == "host":
+            __accumulate_host(accumulation, item)
+    (
+        results,
+        _,
+        nvts_counts,
+        _,
+        graphs,
+    ) = __finish_accumulation(accumulation, nvt_limit=None)
+
+    hosts = state["hosts"]
+    hosts_per_nvt = state["hosts_per_nvt"]
+    hosts_per_os = __graph_counter(overview, "vulnerable_equipment", "os")
+    hosts_per_port = __graph_counter(overview, "ports", "port")
+    for (key, added), host in zip(accumulation["by_host"].items(), results):
+        known = hosts.get(key)
+        if known is None:
+            known = hosts[key] = {
+                "index": len(report["results"]),
+                "nvts": set(),
+            }
+            report["results"].append(host)
+            merged = host
+            hosts_per_os[host["equipment"]["os"]] += 1
+            ports = set()
+        else:
+            existing = report["results"][known["index"]]
+            ports = set(existing["equipment"]["ports"])
+            os = existing["equipment"]["os"]
+            merged = report["results"][known["index"]] = __merge_host(
+                existing, host, added["ports_as_set"]
+            )
+            if os != merged["equipment"]["os"]:
+                hosts_per_os[os] -= 1
+                hosts_per_os[merged["equipment"]["os"]] += 1
+        known["threats"] = {
+            threat: merged["threats"][threat] for threat in __threats
+        }
+        known["os"] = merged["equipment"]["os"]
+        known["hostname"] = merged["hostname"]
+        hosts_per_port.update(added["ports"] - ports)
+        for oid, name in added["nvts"].items():
+            if oid not in known["nvts"]:
+                known["nvts"].add(oid)
+                hosts_per_nvt[oid] += 1
+                state["nvt_names"].setdefault(oid, name)
+    __apply_host_details(report, state, accumulation, hosts_per_os)
+
+    overview["hosts"] = __host_overview(
+        {key: dict(known["threats"]) for key, known in hosts.items()},
+        overview["is_container_image_scan"],
+        host_limit,
+    )
+    overview["nvts"] = {
+        threat: overview["nvts"].get(threat, 0) + amount
+        for threat, amount in nvts_counts.items()
+    }
+    severities = __graph_counter(overview, "severities", "severity")
+    for count in graphs["severities"].counts:
+        severities[count.severity] += count.amount
+    overview["vulnerable_equipment"] = shallow_asdict(
+        CountGraph(
+            "vulnerable_equipment",
+            None,
+            [
+                OSCount(os, amount)
+                for os, amount in __most_common(+hosts_per_os)
+            ],
+        )
+    )
+    overview["top_nvts"] = shallow_asdict(
+        CountGraph(
+            "top_nvts",
+            None,
+            [
+                NVTCount(oid, amount, state["nvt_names"][oid])
+                for oid, amount in __most_common(hosts_per_nvt, nvt_limit)
+            ],
+        )
+    )
+    overview["ports"] = shallow_asdict(
+        CountGraph(
+            "ports",
+            None,
+            [
+                PortCount(port, amount)
+                for port, amount in __most_common(hosts_per_port)
+            ],
+        )
+    )
+    overview["severities"] = shallow_asdict(
+        CountGraph(
+            "severities",
+            None,
+            [
+                SeverityCount(str(i + 1), severities[str(i + 1)])
+                for i in range(10)
+            ],
+        )
+    )
+    return state
@@ -17,8 +17,10 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # pylint: disable=W0614,W0511,W0401,C0103
-from dataclasses import dataclass
-from typing import Dict, List, Union
+from collections.abc import Mapping
+from dataclasses import dataclass, fields, is_dataclass
+from operator import attrgetter
+from typing import Dict, List, Optional, Union
 
 
 @dataclass
@@ -48,10 +50,15 @@ class HostCount:
 
 
 @dataclass
-class CountGraph:
-    name: str
-    chart: str
-    counts: List[Union[NVTCount, HostCount]]
+class OSCount:
+    os: str
+    amount: int
+
+
+@dataclass
+class PortCount:
+    port: str
+    amount: int
 
 
 @dataclass
@@ -60,12 +67,372 @@ class SeverityCount:
     amount: int
 
 
+@dataclass
+class CountGraph:
+    name: str
+    chart: Optional[str]
+    counts: List[Union[NVTCount, HostCount, OSCount, PortCount, SeverityCount]]
+
+
 @dataclass
 class Overview:
     hosts: CountGraph
     nvts: CountGraph
     vulnerable_equipment: CountGraph
     is_container_image_scan: bool = False
+    top_nvts: Optional[CountGraph] = None
+    ports: Optional[CountGraph] = None
+    severities: Optional[CountGraph] = None
+
+
+class _Entry(Mapping):
+    """
+    Base of the compact per host and per result model.
+
+    A report contains a lot of hosts, results, notes and overrides; as dicts
+    each of them would repeat its keys. The entries are using __slots__
+    instead but still behave like a read only dict, so that templates and
+    renderer can access them by key or by attribute. Only the fields listed
+    in _fields are writeable by key.
+    """
+
+    __slots__ = ()
+    _fields = ()
+
+    def _extra(self) -> Mapping:
+        return {}
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            return getattr(self, key)
+        return self._extra()[key]
+
+    def __setitem__(self, key, value):
+        if key not in self._fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __getattr__(self, name):
+        # is only called for names which are not a slot
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self._extra()[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __iter__(self):
+        yield from self._fields
+        yield from self._extra()
+
+    def __len__(self):
+        return len(self._fields) + len(self._extra())
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({dict(self.items())!r})"
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # pickling entries is done for every result of a stored report
+        cls._slot_values = attrgetter(*cls.__slots__)
+
+    def __reduce__(self):
+        return (self.__class__, self._slot_values(self))
+
+    def as_dict(self) -> Dict:
+        return {key: as_dict(value) for key, value in self.items()}
+
+
+def as_dict(value):
+    """
+    converts entries within value into dicts; is used by renderer which are
+    not able to deal with mappings.
+    """
+    if isinstance(value, _Entry):
+        return value.as_dict()
+    if isinstance(value, dict):
+        return {key: as_dict(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [as_dict(item) for item in value]
+    return value
+
+
+def shallow_asdict(value):
+    """
+    converts dataclasses within value into dicts like dataclasses.asdict but
+    without copying anything else.
+
+    Lists and dicts are only recreated when they contain dataclasses; e.g.
+    the results of a report are kept as they are instead of being deep copied.
+    """
+    if is_dataclass(value) and not isinstance(value, type):
+        return {
+            field.name: shallow_asdict(getattr(value, field.name))
+            for field in fields(value)
+        }
+    if isinstance(value, list):
+        converted = [shallow_asdict(item) for item in value]
+        if any(a is not b for a, b in zip(converted, value)):
+            return converted
+    elif isinstance(value, dict):
+        converted = {key: shallow_asdict(item) for key, item in value.items()}
+        if any(converted[key] is not item for key, item in value.items()):
+            return converted
+    return value
+
+
+class Note(_Entry):
+    __slots__ = _fields = ("text", "text_excerpt")
+
+    def __init__(self, text: str, text_excerpt: str):
+        self.text = text
+        self.text_excerpt = text_excerpt
+
+
+class Override(_Entry):
+    __slots__ = _fields = (
+        "text",
+        "text_excerpt",
+        "severity",
+        "severity_description",
+        "new_severity",
+    )
+
+    def __init__(
+        self,
+        text: str,
+        text_excerpt: str,
+        severity: str,
+        severity_description: str,
+        new_severity: str,
+    ):
+        self.text = text
+        self.text_excerpt = text_excerpt
+        self.severity = severity
+        self.severity_description = severity_description
+        self.new_severity = new_severity
+
+
+class Result(_Entry):
+    """
+    A result of a host.
+
+    The nvt_* and qod_* fields are kept in mappings which are shared between
+    results of the same NVT and QoD; therefore they must not be modified.
+    """
+
+    __slots__ = (
+        "hostname",
+        "port",
+        "threat",
+        "severity",
+        "description",
+        "_nvt",
+        "_qod",
+        "notes",
+        "overrides",
+    )
+    _fields = (
+        "hostname",
+        "port",
+        "threat",
+        "severity",
+        "description",
+        "notes",
+        "overrides",
+    )
+
+    # pylint: disable=R0913
+    def __init__(
+        self,
+        hostname: Optional[str],
+        port: Optional[str],
+        threat: str,
+        severity: float,
+        description: Optional[str],
+        _nvt: Mapping,
+        _qod: Mapping,
+        notes: List[Note],
+        overrides: List[Override],
+    ):
+        self.hostname = hostname
+        self.port = port
+        self.threat = threat
+        self.severity = severity
+        self.description = description
+        self._nvt = _nvt
+        self._qod = _qod
+        self.notes = notes
+        self.overrides = overrides
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            return getattr(self, key)
+        if key in self._nvt:
+            return self._nvt[key]
+        return self._qod[key]
+
+    def _extra(self) -> Mapping:
+        return {**self._nvt, **self._qod}
+
+    def __iter__(self):
+        yield from self._fields[:5]
+        yield from self._nvt
+        yield from self._qod
+        yield from self._fields[5:]
+
+    def __len__(self):
+        return len(self._fields) + len(self._nvt) + len(self._qod)
+
+
+class HostResult(_Entry):
+    """
+    The results of a host with its threat and severity overview.
+    """
+
+    __slots__ = (
+        "host",
+        "hostname",
+        "hostnames",
+        "_oci_image",
+        "threats",
+        "severities",
+        "equipment",
+        "results",
+    )
+    _fields = (
+        "host",
+        "hostname",
+        "hostnames",
+        "threats",
+        "severities",
+        "equipment",
+        "results",
+    )
+
+    # pylint: disable=R0913
+    def __init__(
+        self,
+        host: str,
+        hostname: str,
+        hostnames: List[str],
+        _oci_image: Dict,
+        threats: Dict,
+        severities: Dict,
+        equipment: Dict,
+        results: List[Result],
+    ):
+        self.host = host
+        self.hostname = hostname
+        self.hostnames = hostnames
+        self._oci_image = _oci_image
+        self.threats = threats
+        self.severities = severities
+        self.equipment = equipment
+        self.results = results
+
+    def _extra(self) -> Mapping:
+        return self._oci_image
+
+    def __iter__(self):
+        yield from self._fields[:3]
+        yield from self._oci_image
+        yield from self._fields[3:]
+
+
+class Occurrence(_Entry):
+    """
+    A result of a NVT on a host within a report grouped by NVT.
+
+    The description is None when it is the same as the one of the NVT.
+    """
+
+    __slots__ = (
+        "host",
+        "hostname",
+        "port",
+        "threat",
+        "severity",
+        "description",
+        "_qod",
+        "notes",
+        "overrides",
+    )
+    _fields = (
+        "host",
+        "hostname",
+        "port",
+        "threat",
+        "severity",
+        "description",
+        "notes",
+        "overrides",
+    )
+
+    # pylint: disable=R0913
+    def __init__(
+        self,
+        host: str,
+        hostname: Optional[str],
+        port: Optional[str],
+        threat: str,
+        severity: float,
+        description: Optional[str],
+        _qod: Mapping,
+        notes: List[Note],
+        overrides: List[Override],
+    ):
+        self.host = host
+        self.hostname = hostname
+        self.port = port
+        self.threat = threat
+        self.severity = severity
+        self.description = description
+        self._qod = _qod
+        self.notes = notes
+        self.overrides = overrides
+
+    def _extra(self) -> Mapping:
+        return self._qod
+
+    def __iter__(self):
+        yield from self._fields[:6]
+        yield from self._qod
+        yield from self._fields[6:]
+
+
+class NVTResult(_Entry):
+    """
+    The shared nvt_* fields of a NVT with its occurrences within a report
+    grouped by NVT.
+
+    Threat and severity are the ones of the occurrence with the highest
+    severity.
+    """
+
+    __slots__ = ("_nvt", "threat", "severity", "description", "results")
+    _fields = ("threat", "severity", "description", "results")
+
+    def __init__(
+        self,
+        _nvt: Mapping,
+        threat: str,
+        severity: float,
+        description: Optional[str],
+        results: List[Occurrence],
+    ):
+        self._nvt = _nvt
+        self.threat = threat
+        self.severity = severity
+        self.description = description
+        self.results = results
+
+    def _extra(self) -> Mapping:
+        return self._nvt
+
+    def __iter__(self):
+        yield from self._nvt
+        yield from self._fields
 
 
 @dataclass
@@ -75,7 +442,9 @@ class Report:
     comment: str
     start: str
     overview: Overview
-    results: List[Dict]
+    results: List[Union[HostResult, NVTResult]]
+    # either host or nvt
+    grouping: str = "host"
 
 
 def describe():
@@ -101,6 +470,21 @@ def describe():
                 counts=[],
             ),
             is_container_image_scan="bool; indicates if the report is for a container image scan",
+            top_nvts=CountGraph(
+                name="top_nvts",
+                chart="str; link to chart image (base64 encoded datalink)",
+                counts=[],
+            ),
+            ports=CountGraph(
+                name="ports",
+                chart="str; link to chart image (base64 encoded datalink)",
+                counts=[],
+            ),
+            severities=CountGraph(
+                name="severities",
+                chart="str; link to chart image (base64 encoded datalink)",
+                counts=[],
+            ),
         ),
         results=[
             dict(
@@ -158,4 +542,8 @@ def describe():
                 },
             )
         ],
+        grouping="str; host or nvt; when nvt a result contains the nvt.* "
+        "fields, threat, severity and description of a NVT and its results "
+        "contain host, hostname, port, threat, severity, description, qod.*, "
+        "notes and overrides",
     )
@@ -20,12 +20,12 @@ import logging
 from base64 import b64encode
 from typing import Dict
 
-from django.core.cache import cache
 from django.template import Context, Template
 from rest_framework import renderers
 from rest_framework.request import Request
 from weasyprint import CSS, HTML
 
+from pheme import storage
 from pheme.authentication import get_username_role
 from pheme.errors import TemplateNotFoundError
 from pheme.parameter import load_params
@@ -75,7 +75,7 @@ class Report(renderers.BaseRenderer):
         logger.debug("generating report %s", cache_key)
 
         if cache_key and not DEBUG:
-            cached = cache.get(cache_key)
+            cached = storage.backend().load(cache_key)
             if cached:
                 return cached
         params = load_params()
@@ -88,7 +88,7 @@ class Report(renderers.BaseRenderer):
 
         result = self.apply(name, data, params)
         if cache_key:
-            cache.set(cache_key, result)
+            storage.backend().store(cache_key, result)
         return result
 
     def apply(self, name: str, data: Dict, parameter: Dict):
@@ -97,8 +97,18 @@ class Report(renderers.BaseRenderer):
         )
 
 
+def invalidate(name: str):
+    """
+    removes the cached rendered reports of name
+    """
+    storage.backend().delete(
+        *[f"{report.media_type}/{name}" for report in Report.__subclasses__()]
+    )
+
+
 class VulnerabilityHTMLReport(Report):
     __template = "vulnerability_report_html_template"
+    __nvt_template = "vulnerability_report_nvt_html_template"
     __css_template = "vulnerability_report_html_css"
     media_type = "text/html"
     format = "html"
@@ -108,8 +118,13 @@ class VulnerabilityHTMLReport(Report):
             Context(parameter)
         )
         data["css"] = css
+        template = (
+            self.__nvt_template
+            if data.get("grouping") == "nvt"
+            else self.__template
+        )
 
-        return _load_template(self.__template).render(
+        return _load_template(template).render(
             Context(_enrich(name, data, parameter))
         )
 
@@ -166,7 +181,14 @@ def enforce_limit(
         data["results"] = data["results"][:max_hosts]
         host_cut = True
     result_cut = False
-    if max_results_in_host:
+    if max_results_in_host and isinstance(data["results"], storage.LazyHosts):
+        # the hosts are loaded per chunk; cutting them would get lost
+        counts = data["results"].results_per_host()
+        if counts is None:
+            counts = (len(host["results"]) for host in data["results"])
+        result_cut = any(count > max_results_in_host for count in counts)
+        data["results"] = data["results"].limited(max_results_in_host)
+    elif max_results_in_host:
         for result in data["results"]:
             if len(result["results"]) > max_results_in_host:
                 result["results"] = result["results"][:max_results_in_host]
@@ -196,6 +218,7 @@ class VulnerabilityPDFReport(Report):
     """
 
     __template = "vulnerability_report_pdf_template"
+    __nvt_template = "vulnerability_report_nvt_pdf_template"
     __css_template = "vulnerability_report_pdf_css"
     media_type = "application/pdf"
     format = "binary"
@@ -205,7 +228,12 @@ class VulnerabilityPDFReport(Report):
         css = _load_template(self.__css_template, parameter).render(
             Context(parameter)
         )
-        html_template = _load_template(self.__template, parameter)
+        html_template = _load_template(
+            self.__nvt_template
+            if data.get("grouping") == "nvt"
+            else self.__template,
+            parameter,
+        )
         html = html_template.render(Context(_enrich(name, data, parameter)))
         html = _replace_inline_svg_with_img_tags(html)
         logger.debug("created html")
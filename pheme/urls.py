@@ -50,6 +50,16 @@ urlpatterns = [
     path("unmodified", pheme.views.unmodified, name="unmodified"),
     path("transform", pheme.views.transform, name="transform"),
     path("transform/", pheme.views.transform),
+    path(
+        "transform/batch", pheme.views.transform_batch, name="transform_batch"
+    ),
+    path("transform/jobs", pheme.views.transform_job, name="transform_job"),
+    path(
+        "transform/jobs/<str:job_id>",
+        pheme.views.transform_job_status,
+        name="transform_job_status",
+    ),
+    path("transform/<str:name>/append", pheme.views.append, name="append"),
     path(
         "scanreport/data/description",
         pheme.views.scanreport_data_description,
@@ -17,24 +17,63 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import dataclasses
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional
 
 import rest_framework.renderers
 from rest_framework.decorators import api_view, parser_classes, renderer_classes
+from rest_framework.exceptions import ParseError
 from rest_framework.request import Request
 from rest_framework.response import Response
 
-from pheme.parser.xml import XMLFormParser, XMLParser
+from pheme import jobs, settings
+from pheme.parameter import load_params
+from pheme.parser.batch import (
+    BatchFormParser,
+    ReportBatch,
+    ReportFile,
+    TarParser,
+    ZipParser,
+)
+from pheme.parser.msgpack import MsgPackParser
+from pheme.parser.xml import (
+    ReportStream,
+    StreamingXMLFormParser,
+    StreamingXMLParser,
+    XMLParser,
+)
 from pheme.renderer import CSVRenderer, MarkDownTableRenderer, XMLRenderer
-from pheme.storage import load, store
+from pheme.storage import (
+    ChangedHosts,
+    LazyHosts,
+    add_reference,
+    load,
+    reference,
+    release,
+    store,
+    update_report,
+)
 from pheme.transformation import scanreport
 from pheme.transformation.scanreport import model
 from pheme.version import __version__
 
 
+def __materialized(value):
+    """
+    replaces the lazily loaded hosts of a report by a list for renderers
+    which serialize the hosts at once.
+    """
+    if isinstance(value, dict) and isinstance(value.get("results"), LazyHosts):
+        value["results"] = list(value["results"])
+    return value
+
+
 @api_view(["GET"])
 @renderer_classes([rest_framework.renderers.JSONRenderer])
 def load_cache(request, key):
-    return Response(load(key))
+    return Response(__materialized(load(key)))
 
 
 @api_view(["POST"])
@@ -52,17 +91,291 @@ def store_cache(request):
     return Response(name)
 
 
+def __report_data(request):
+    """
+    returns the uploaded report; pre-structured JSON or msgpack reports have to
+    be a mapping shaped like the parsed gvmd XML.
+    """
+    data = request.data
+    if isinstance(data, ReportStream):
+        return data
+    report = data.get("report") if isinstance(data, dict) else None
+    # like the parsed XML the report may be nested within .report.report
+    if isinstance(report, dict) and "report" in report:
+        report = report["report"]
+    if not isinstance(report, dict):
+        raise ParseError("expected a gvmd report")
+    return data
+
+
+def __overview_limit(params: Dict, key: str, default: Optional[int]):
+    """
+    returns the limit stored as parameter key or default when it is missing;
+    an empty parameter means no limit while 0 keeps nothing. Anything else
+    than a non negative integer is rejected.
+    """
+    value = params.get(key, default)
+    if value is None or value == "":
+        return None
+    try:
+        limit = None if isinstance(value, bool) else int(value)
+    except (TypeError, ValueError):
+        limit = None
+    if limit is None or limit < 0:
+        raise ParseError(f"invalid {key}: {value!r}")
+    return limit
+
+
+def __overview_limits() -> Dict:
+    params = load_params()
+    return {
+        "host_limit": __overview_limit(params, "overview_host_limit", None),
+        "nvt_limit": __overview_limit(params, "overview_nvt_limit", 10),
+    }
+
+
+def __filter_criteria(request: Request) -> Dict:
+    """
+    returns the keyword arguments of result_filter out of the query parameter
+    min_severity, min_qod, threats and exclude_families; threats and
+    exclude_families are comma separated.
+    """
+
+    def values_of(key: str) -> List[str]:
+        return [
+            value
+            for values in request.query_params.getlist(key)
+            for value in values.split(",")
+            if value
+        ]
+
+    min_severity = request.query_params.get("min_severity")
+    min_qod = request.query_params.get("min_qod")
+    try:
+        return {
+            "min_severity": float(min_severity) if min_severity else None,
+            "min_qod": int(min_qod) if min_qod else None,
+            "threats": values_of("threats"),
+            "exclude_families": values_of("exclude_families"),
+        }
+    except ValueError as error:
+        raise ParseError(f"invalid filter: {error}") from error
+
+
+def __grouping(request: Request) -> str:
+    """
+    returns the grouping of the transformed report; either host or nvt.
+    """
+    grouping = request.query_params.get("grouping", "host")
+    if grouping not in ("host", "nvt"):
+        raise ParseError(f"invalid grouping: {grouping}")
+    return grouping
+
+
+def __result_filter(request: Request) -> Optional[Callable[[Dict], bool]]:
+    """
+    creates the result filter out of the query parameter of request.
+    """
+    try:
+        return scanreport.gvmd.result_filter(**__filter_criteria(request))
+    except ValueError as error:
+        raise ParseError(f"invalid filter: {error}") from error
+
+
+def __transformation(request: Request) -> Callable[..., str]:
+    """
+    returns a function transforming and storing the report of request; the
+    function returns the stored name and accepts a progress function which
+    is called with the amount of parsed results.
+
+    The options are taken from request immediately so that the function can
+    be called after request got answered.
+    """
+    data = __report_data(request)
+    limits = __overview_limits()
+    grouping = __grouping(request)
+    result_filter = __result_filter(request)
+    # identical uploads with identical options share the transformed report
+    options = json.dumps(
+        [sorted(request.query_params.lists()), limits], sort_keys=True
+    )
+
+    def run(progress: Optional[Callable[[int], None]] = None) -> str:
+        key = None
+        if isinstance(data, ReportStream):
+            key = "-".join(
+                [
+                    data.sha256(),
+                    hashlib.sha256(options.encode()).hexdigest(),
+                ]
+            )
+            name = reference(key)
+            if name:
+                return name
+            data.progress = progress
+        name = store(
+            "scanreport",
+            model.shallow_asdict(
+                scanreport.gvmd.transform(
+                    data,
+                    grouping=grouping,
+                    result_filter=result_filter,
+                    **limits,
+                )
+            ),
+        )
+        if key:
+            add_reference(key, name)
+        return name
+
+    return run
+
+
 @api_view(["POST"])
-@parser_classes([XMLParser, XMLFormParser])
+@parser_classes(
+    [
+        StreamingXMLParser,
+        StreamingXMLFormParser,
+        rest_framework.parsers.JSONParser,
+        MsgPackParser,
+    ]
+)
 @renderer_classes([rest_framework.renderers.JSONRenderer])
 def transform(request):
-    name = store(
-        "scanreport",
-        dataclasses.asdict(scanreport.gvmd.transform(request.data)),
+    return Response(__transformation(request)())
+
+
+@api_view(["POST"])
+@parser_classes(
+    [
+        StreamingXMLParser,
+        StreamingXMLFormParser,
+        rest_framework.parsers.JSONParser,
+        MsgPackParser,
+    ]
+)
+@renderer_classes([rest_framework.renderers.JSONRenderer])
+def transform_job(request):
+    run = __transformation(request)
+    if isinstance(request.data, ReportStream):
+        # the upload is gone once the request got answered
+        request.data.spool()
+    job_id = jobs.submit(run)
+    if job_id is None:
+        return Response("too many transform jobs", status=503)
+    return Response(job_id, status=202)
+
+
+@api_view(["GET"])
+@renderer_classes([rest_framework.renderers.JSONRenderer])
+def transform_job_status(request, job_id):
+    job = jobs.status(job_id)
+    if not job:
+        return Response(f"no job found for {job_id}", status=404)
+    return Response(job)
+
+
+@api_view(["POST"])
+@parser_classes(
+    [
+        StreamingXMLParser,
+        StreamingXMLFormParser,
+        rest_framework.parsers.JSONParser,
+        MsgPackParser,
+    ]
+)
+@renderer_classes([rest_framework.renderers.JSONRenderer])
+def append(request, name):
+    report = load(name)
+    if not report:
+        return Response(f"not data found for {name}", status=404)
+    if report.get("grouping", "host") != "host":
+        return Response(f"{name} is not grouped by host", status=400)
+    hosts = report.get("results") or []
+    # append changes the hosts in place; of chunked hosts just the chunks of
+    # the appended hosts get loaded and stored again
+    report["results"] = (
+        ChangedHosts(hosts) if isinstance(hosts, LazyHosts) else list(hosts)
+    )
+    state = scanreport.gvmd.append(
+        report,
+        __report_data(request),
+        load(f"{name}-append-state"),
+        result_filter=__result_filter(request),
+        **__overview_limits(),
     )
+    if release(name) > 0:
+        # the report is shared with identical uploads; keep it for them
+        report["results"] = list(report["results"])
+        name = store("scanreport", report)
+    elif isinstance(report["results"], ChangedHosts):
+        update_report(name, report)
+        scanreport.renderer.invalidate(name)
+    else:
+        store(name, report, id_generator=str)
+        scanreport.renderer.invalidate(name)
+    store(f"{name}-append-state", state, id_generator=str)
     return Response(name)
 
 
+def __transform_report_file(report: ReportFile, options: Dict) -> Dict:
+    """
+    transforms and stores a report of a batch upload; a failure is returned
+    instead of raised so that it does not affect the other reports.
+    """
+    try:
+        with report.open() as data:
+            transformed = scanreport.gvmd.transform(
+                data,
+                workers=1,
+                grouping=options["grouping"],
+                result_filter=scanreport.gvmd.result_filter(
+                    **options["criteria"]
+                ),
+                **options["limits"],
+            )
+        name = store("scanreport", model.shallow_asdict(transformed))
+    except Exception as error:  # pylint: disable=broad-except
+        return {"file": report.name, "error": str(error)}
+    return {"file": report.name, "name": name}
+
+
+@api_view(["POST"])
+@parser_classes([BatchFormParser, TarParser, ZipParser])
+@renderer_classes([rest_framework.renderers.JSONRenderer])
+def transform_batch(request):
+    reports = request.data
+    if not isinstance(reports, ReportBatch) or not reports:
+        raise ParseError("expected gvmd reports")
+    # fail early on invalid options instead of once per report
+    __result_filter(request)
+    options = {
+        "grouping": __grouping(request),
+        "criteria": __filter_criteria(request),
+        "limits": __overview_limits(),
+    }
+    try:
+        workers = min(settings.TRANSFORM_BATCH_WORKERS, len(reports))
+        if workers < 2:
+            return Response(
+                [__transform_report_file(report, options) for report in reports]
+            )
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = [
+                executor.submit(__transform_report_file, report, options)
+                for report in reports
+            ]
+            results = []
+            for report, future in zip(reports, pending):
+                try:
+                    results.append(future.result())
+                except Exception as error:  # pylint: disable=broad-except
+                    results.append({"file": report.name, "error": str(error)})
+        return Response(results)
+    finally:
+        reports.close()
+
+
 @api_view(["POST"])
 @parser_classes([XMLParser])
 @renderer_classes([rest_framework.renderers.JSONRenderer])
@@ -117,6 +430,14 @@ def report(request: Request, name: str):
             }
         )
     data = load(name)
+    if not data:
+        # the renderers answer with not found
+        return Response(data, status=404)
+    if not isinstance(
+        request.accepted_renderer, (scanreport.renderer.Report, CSVRenderer)
+    ):
+        # only the report renderer and csv iterate over the hosts lazily
+        data = __materialized(data)
     data["pheme_version"] = int("".join(filter(str.isdigit, __version__)))
     if request.GET.get("without_overview"):
         # remove charts
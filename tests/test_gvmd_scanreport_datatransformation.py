@@ -17,11 +17,19 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import dataclasses
+import pickle
+from io import BytesIO
+
 import pytest
+import xmltodict
 
+from pheme.parser.xml import ReportStream
+from pheme.transformation.scanreport import gvmd
 from pheme.transformation.scanreport.gvmd import (
     transform,
 )
+from pheme.transformation.scanreport.model import as_dict, shallow_asdict
 from tests.generate_test_data import gen_report
 
 oids = [f"oid_{i}" for i in range(5)]
@@ -65,3 +73,274 @@ def test_report_generation_per_host(expected):
     data = {"report": {"report": scan_results}}
     report = transform(data)
     assert len(report.results or []) == amount_scans
+
+
+def test_streamed_report_equals_parsed_report():
+    scan_results = gen_report(hosts, oids, port="80/tcp")
+    xml = xmltodict.unparse({"report": {"report": scan_results}})
+    parsed = xmltodict.parse(
+        xml, attr_prefix="", cdata_key="text", dict_constructor=dict
+    )
+    streamed = transform(ReportStream(BytesIO(xml.encode())))
+    assert dataclasses.asdict(streamed) == dataclasses.asdict(transform(parsed))
+
+
+def test_notes_and_overrides_per_result():
+    scan_results = gen_report(["first"], ["oid_1"])
+    for result in scan_results["results"]["result"]:
+        result["notes"] = {"note": {"text": {"text": "a", "excerpt": "1"}}}
+        result["overrides"] = {
+            "override": [
+                {"text": "b", "severity": "0.0", "new_severity": "5.0"},
+                {"text": "c", "severity": "", "new_severity": "1.0"},
+            ]
+        }
+    data = {"report": {"report": scan_results}}
+    report = transform(data)
+    result = report.results[0]["results"][0]
+    assert result["notes"] == [{"text": "a", "text_excerpt": "1"}]
+    assert [o["severity_description"] for o in result["overrides"]] == [
+        "Log",
+        "Any severity",
+    ]
+    assert result["overrides"][0]["text_excerpt"] == "0"
+
+
+def test_results_of_same_nvt_share_interpreted_values():
+    scan_results = gen_report(["a", "b", "c"], ["oid_1"])
+    nvt = scan_results["results"]["result"][0]["nvt"]
+    for result in scan_results["results"]["result"]:
+        result["nvt"] = dict(nvt)
+    scan_results["results"]["result"][-1]["nvt"]["tags"] = "a=b"
+    data = {"report": {"report": scan_results}}
+    report = transform(data)
+    results = [r for host in report.results for r in host["results"]]
+    assert len(results) > 2
+    first, *others, last = results
+    for other in others:
+        assert other["nvt_tags_interpreted"] is first["nvt_tags_interpreted"]
+        assert other["nvt_refs_ref"] is first["nvt_refs_ref"]
+    assert last["nvt_tags_interpreted"] == {"a": "b"}
+
+
+def test_results_behave_like_dicts():
+    scan_results = gen_report(hosts, oids, port="80/tcp")
+    data = {"report": {"report": scan_results}}
+    report = transform(data)
+    host = report.results[0]
+    result = host.results[0]
+    assert result.nvt_oid == result["nvt_oid"]
+    assert result.qod_value == result["qod_value"]
+    assert host.equipment is host["equipment"]
+    assert list(as_dict(host)) == [
+        "host",
+        "hostname",
+        "hostnames",
+        "threats",
+        "severities",
+        "equipment",
+        "results",
+    ]
+    assert list(as_dict(result))[:6] == [
+        "hostname",
+        "port",
+        "threat",
+        "severity",
+        "description",
+        "nvt_oid",
+    ]
+    assert pickle.loads(pickle.dumps(report.results)) == report.results
+
+
+def test_parallel_transformation_equals_sequential():
+    scan_results = gen_report([f"host_{i}" for i in range(20)], oids)
+    data = {"report": {"report": scan_results}}
+    sequential = transform(data, workers=1)
+    parallel = transform(data, workers=3, parallel_threshold=5)
+    assert parallel == sequential
+    assert list(parallel.overview.hosts) == list(sequential.overview.hosts)
+
+
+def test_repeated_values_are_deduplicated():
+    scan_results = gen_report(["a", "b", "c"], oids, port="80/tcp")
+    xml = xmltodict.unparse({"report": {"report": scan_results}})
+    report = transform(ReportStream(BytesIO(xml.encode())))
+    results = [r for host in report.results for r in host["results"]]
+    assert len(results) > 2
+    first, *others = results
+    for other in others:
+        assert other["port"] is first["port"]
+
+
+def test_aggregation_without_numpy(monkeypatch):
+    scan_results = gen_report([f"host_{i}" for i in range(10)], oids)
+    data = {"report": {"report": scan_results}}
+    expected = transform(data)
+    monkeypatch.setattr(gvmd, "numpy", None)
+    report = transform(data)
+    assert report == expected
+    assert sum(report.overview.nvts.values()) == sum(
+        host["threats"]["total"] for host in report.results
+    )
+
+
+def test_host_overview_limited_to_top_hosts():
+    scan_results = gen_report([f"host_{i}" for i in range(10)], oids)
+    data = {"report": {"report": scan_results}}
+    hosts = transform(data).overview.hosts
+    limited = transform(data, host_limit=3).overview.hosts
+    assert list(limited) == list(hosts)[:3] + [gvmd.OTHERS]
+    others = limited[gvmd.OTHERS]
+    for threat, amount in others.items():
+        assert amount == sum(
+            threats.get(threat, 0) for threats in list(hosts.values())[3:]
+        )
+    assert transform(data, host_limit=10).overview.hosts == hosts
+
+
+def test_overview_contains_precomputed_graphs():
+    scan_results = gen_report([f"host_{i}" for i in range(5)], oids)
+    data = {"report": {"report": scan_results}}
+    report = transform(data, nvt_limit=None)
+    overview = report.overview
+    hosts_per_nvt = {}
+    for host in report.results:
+        for oid in {result["nvt_oid"] for result in host["results"]}:
+            hosts_per_nvt[oid] = hosts_per_nvt.get(oid, 0) + 1
+    assert {
+        count.oid: count.amount for count in overview.top_nvts.counts
+    } == hosts_per_nvt
+    assert sum(count.amount for count in overview.severities.counts) == sum(
+        1
+        for host in report.results
+        for result in host["results"]
+        if result["severity"] > 0
+    )
+    assert sum(c.amount for c in overview.vulnerable_equipment.counts) == 5
+    top = transform(data, nvt_limit=1).overview.top_nvts.counts
+    assert len(top) == 1
+    assert top[0].amount == max(hosts_per_nvt.values())
+
+
+def test_appended_results_equal_full_transformation():
+    scan_results = gen_report([f"host_{i}" for i in range(6)], oids)
+    results = scan_results["results"]["result"]
+    half = len(results) // 2
+    first = {**scan_results, "results": {"result": results[:half]}}
+    second = {**scan_results, "results": {"result": results[half:]}}
+
+    def transformed(data):
+        return dataclasses.asdict(transform({"report": {"report": data}}))
+
+    def normalized(report):
+        for host in report["results"]:
+            host["equipment"]["ports"] = sorted(host["equipment"]["ports"])
+        return report
+
+    expected = normalized(transformed(scan_results))
+    report = transformed(first)
+    state = gvmd.append(report, {"report": {"report": second}})
+    assert set(state["hosts"]) == {host["host"] for host in report["results"]}
+    assert normalized(report)["overview"] == expected["overview"]
+    assert report["results"] == expected["results"]
+
+
+def test_appended_host_details_equal_full_transformation():
+    scan_results = gen_report([f"host_{i}" for i in range(3)], oids)
+    results = scan_results["results"]["result"]
+    ips = list(dict.fromkeys(result["host"]["text"] for result in results))
+
+    def part(hosts, details):
+        return {
+            "report": {
+                "report": {
+                    **scan_results,
+                    "results": {
+                        "result": [
+                            result
+                            for result in results
+                            if result["host"]["text"] in hosts
+                        ]
+                    },
+                    "host": scan_results["host"] if details else [],
+                }
+            }
+        }
+
+    expected = dataclasses.asdict(
+        transform({"report": {"report": scan_results}})
+    )
+    # the details of the first host arrive after its results and the ones of
+    # the remaining hosts before them
+    report = dataclasses.asdict(transform(part(ips[:1], details=False)))
+    state = gvmd.append(report, part([], details=True))
+    assert len(report["results"]) == 1
+    state = gvmd.append(report, part(ips[1:], details=False), state)
+    assert not state["host_information"]
+    assert (
+        report["overview"]["vulnerable_equipment"]
+        == (expected["overview"]["vulnerable_equipment"])
+    )
+    assert [host["equipment"]["os"] for host in report["results"]] == [
+        host["equipment"]["os"] for host in expected["results"]
+    ]
+
+
+def test_results_grouped_by_nvt():
+    scan_results = gen_report([f"host_{i}" for i in range(4)], oids)
+    data = {"report": {"report": scan_results}}
+    by_host = transform(data)
+    by_nvt = transform(data, grouping="nvt")
+    assert by_nvt.grouping == "nvt"
+    assert by_nvt.overview == by_host.overview
+    oids_by_host = [
+        result["nvt_oid"] for host in by_host.results for result in host.results
+    ]
+    assert [nvt["nvt_oid"] for nvt in by_nvt.results] == sorted(
+        dict.fromkeys(oids_by_host), key=lambda oid: -float(oid[4:])
+    )
+    assert sum(len(nvt["results"]) for nvt in by_nvt.results) == len(
+        oids_by_host
+    )
+    for nvt in by_nvt.results:
+        for occurrence in nvt["results"]:
+            assert occurrence["host"] in {h["host"] for h in by_host.results}
+            assert occurrence["severity"] <= nvt["severity"]
+    with pytest.raises(ValueError):
+        transform(data, grouping="unknown")
+
+
+def test_results_filtered_while_transforming():
+    scan_results = gen_report([f"host_{i}" for i in range(4)], oids)
+    xml = xmltodict.unparse({"report": {"report": scan_results}})
+    result_filter = gvmd.result_filter(
+        min_severity=0.2, min_qod=0, threats=["High", "Medium"]
+    )
+    expected = [
+        result
+        for result in scan_results["results"]["result"]
+        if result["threat"] in ("High", "Medium")
+        and float(result["severity"]) >= 0.2
+    ]
+    parsed = transform(
+        {"report": {"report": scan_results}}, result_filter=result_filter
+    )
+    streamed = transform(
+        ReportStream(BytesIO(xml.encode())), result_filter=result_filter
+    )
+    assert streamed == parsed
+    assert sum(len(host["results"]) for host in parsed.results) == len(expected)
+    assert gvmd.result_filter() is None
+    excluded = gvmd.result_filter(exclude_families=["family"])
+    assert not excluded({"nvt": {"family": "family"}})
+    assert excluded({"nvt": {"family": "other"}})
+
+
+def test_shallow_asdict_does_not_copy_results():
+    scan_results = gen_report([f"host_{i}" for i in range(3)], oids)
+    report = transform({"report": {"report": scan_results}})
+    stored = shallow_asdict(report)
+    assert stored == dataclasses.asdict(report)
+    assert stored["results"] is report.results
+    assert stored["overview"]["hosts"] is report.overview.hosts
+    assert isinstance(stored["overview"]["top_nvts"], dict)
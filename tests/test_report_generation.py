@@ -17,17 +17,26 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from typing import List, Optional
+import gzip
+import io
+import tarfile
+import time
+import zipfile
+from typing import List, Optional, Tuple
 from unittest.mock import patch
 
 import pytest
+import xmltodict
 from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
 from rest_framework.test import APIClient
 
 from pheme.datalink import as_datalink
+from pheme.parser.batch import ZipParser
 from pheme.settings import SECRET_KEY
-from pheme.transformation.scanreport import renderer
+from pheme.storage import load, store
+from pheme.transformation.scanreport import gvmd, renderer
 from tests.generate_test_data import gen_report
 
 
@@ -66,7 +75,7 @@ def test_report_contains_equipment():
     }
     response = client.post(url, data=report, format="xml")
     assert response.status_code == 200
-    result = cache.get(response.data)
+    result = load(response.data)
     assert result["results"][0]["equipment"]["os"] == "rusty rust rust"
     assert result["results"][0]["equipment"]["ports"] is not None
 
@@ -81,13 +90,51 @@ def test_report_contains_charts():
     }
     response = client.post(url, data=report, format="xml")
     assert response.status_code == 200
-    result = cache.get(response.data)
+    result = load(response.data)
     assert result["overview"] is not None
     assert result["overview"]["hosts"] is not None
     assert result["overview"]["nvts"] is not None
     # assert result['overview']['vulnerable_equipment'] is not None
 
 
+def test_append_results_to_report():
+    client = APIClient()
+    report = gen_report(generate("host", 3), generate("oid", 5))
+    results = report["results"]["result"]
+    first = {**report, "results": {"result": results[:2]}}
+    second = {**report, "results": {"result": results[2:]}}
+    response = client.post(
+        reverse("transform"), data={"report": {"report": first}}, format="xml"
+    )
+    assert response.status_code == 200
+    name = response.data
+    store(f"text/html/{name}", "rendered", id_generator=str)
+    response = client.post(
+        reverse("append", kwargs={"name": name}),
+        data={"report": {"report": second}},
+        format="xml",
+    )
+    assert response.status_code == 200
+    assert response.data == name
+    result = load(name)
+    assert sum(len(host["results"]) for host in result["results"]) == len(
+        results
+    )
+    assert sum(result["overview"]["nvts"].values()) == len(results)
+    assert load(f"text/html/{name}") is None
+
+
+def test_append_to_unknown_report():
+    client = APIClient()
+    report = gen_report(generate("host", 1), generate("oid", 1))
+    response = client.post(
+        reverse("append", kwargs={"name": "scanreport-unknown"}),
+        data={"report": {"report": report}},
+        format="xml",
+    )
+    assert response.status_code == 404
+
+
 @pytest.mark.parametrize(
     "html_contains",
     [
@@ -342,3 +389,388 @@ def test_html_report_contains_user_paramater(user_information):
     assert report_response.status_code == 200
     html_report = report_response.getvalue().decode("utf-8")
     assert html_report == "<html><body><p>#fff</p></body></html>"
+
+
+@pytest.mark.parametrize(
+    "http_accept",
+    [
+        "text/html",
+        "text/csv",
+    ],
+)
+def test_report_grouped_by_nvt(http_accept):
+    client = APIClient()
+    response = client.put(
+        reverse("put_parameter"),
+        data={
+            "vulnerability_report_html_css": "html { background: #000; }",
+            "vulnerability_report_nvt_html_template": """
+            <html>
+            {% for nvt in results %}
+            <h1>{{ nvt.nvt_oid }}</h1>
+            {% for occurrence in nvt.results %}{{ occurrence.host }} {% endfor %}
+            {% endfor %}
+            </html>
+            """,
+        },
+        HTTP_X_API_KEY=SECRET_KEY,
+    )
+    assert response.status_code == 200
+    report = gen_report(generate("host", 3), ["oid_1"])
+    response = client.post(
+        reverse("transform") + "?grouping=nvt",
+        data={"report": {"report": report}},
+        format="xml",
+    )
+    assert response.status_code == 200
+    report_url = reverse("report", kwargs={"name": response.data})
+    response = client.get(report_url, HTTP_ACCEPT=http_accept)
+    assert response.status_code == 200
+    content = response.getvalue().decode("utf-8")
+    if http_accept == "text/html":
+        assert content.count("<h1>oid_1</h1>") == 1
+    else:
+        rows = content.splitlines()
+        assert len(rows) == len(report["results"]["result"]) + 1
+        assert all("oid_1" in row for row in rows[1:])
+
+
+@pytest.mark.parametrize(
+    "limit, status_code", [(0, 200), ("0", 200), ("many", 400), (-1, 400)]
+)
+def test_transform_with_overview_limits(limit, status_code):
+    report = gen_report(generate("host", 3), generate("oid", 2))
+    params = {"overview_host_limit": limit, "overview_nvt_limit": limit}
+    with patch("pheme.views.load_params", return_value=params):
+        response = APIClient().post(
+            reverse("transform"),
+            data={"report": {"report": report}},
+            format="xml",
+        )
+    assert response.status_code == status_code
+    if status_code == 200:
+        overview = load(response.data)["overview"]
+        assert list(overview["hosts"]) == [gvmd.OTHERS]
+        assert not overview["top_nvts"]["counts"]
+
+
+def test_transform_with_invalid_grouping():
+    report = gen_report(generate("host", 1), generate("oid", 1))
+    data = xmltodict.unparse({"report": {"report": report}}).encode()
+    client = APIClient()
+    response = client.post(
+        reverse("transform") + "?grouping=bad",
+        data=data,
+        content_type="application/xml",
+    )
+    assert response.status_code == 400
+    response = client.post(
+        reverse("transform_batch") + "?grouping=bad",
+        data={"report.xml": SimpleUploadedFile("report.xml", data)},
+        format="multipart",
+    )
+    assert response.status_code == 400
+
+
+def test_identical_uploads_share_transformed_report():
+    # culling of a full cache would remove the references
+    cache.clear()
+    client = APIClient()
+    report = gen_report(generate("host", 2), generate("oid", 3))
+    results = report["results"]["result"]
+    data = {"report": {"report": report}}
+
+    def transform(query=""):
+        response = client.post(
+            reverse("transform") + query, data=data, format="xml"
+        )
+        assert response.status_code == 200
+        return response.data
+
+    name = transform()
+    assert transform() == name
+    assert transform("?grouping=nvt") != name
+    appended = client.post(
+        reverse("append", kwargs={"name": name}), data=data, format="xml"
+    ).data
+    # the report is shared therefore the appended one is a copy
+    assert appended != name
+    assert sum(len(host["results"]) for host in load(name)["results"]) == (
+        len(results)
+    )
+    # the last reference to the appended copy modifies it in place
+    assert (
+        client.post(
+            reverse("append", kwargs={"name": appended}),
+            data=data,
+            format="xml",
+        ).data
+        == appended
+    )
+    # the remaining reference gets released, the report is not shared anymore
+    assert (
+        client.post(
+            reverse("append", kwargs={"name": name}), data=data, format="xml"
+        ).data
+        == name
+    )
+    assert transform() != name
+
+
+def compressed_report(compress) -> Tuple[bytes, int]:
+    report = gen_report(generate("host", 2), generate("oid", 3))
+    xml = xmltodict.unparse({"report": {"report": report}})
+    return compress(xml.encode()), len(report["results"]["result"])
+
+
+def amount_of_results(name: str) -> int:
+    return sum(len(host["results"]) for host in load(name)["results"])
+
+
+def test_transform_gzip_encoded_report():
+    data, amount = compressed_report(gzip.compress)
+    response = APIClient().post(
+        reverse("transform"),
+        data=data,
+        content_type="application/xml",
+        HTTP_CONTENT_ENCODING="gzip",
+    )
+    assert response.status_code == 200
+    assert amount_of_results(response.data) == amount
+
+
+def test_transform_unknown_encoded_report():
+    data, _ = compressed_report(gzip.compress)
+    response = APIClient().post(
+        reverse("transform"),
+        data=data,
+        content_type="application/xml",
+        HTTP_CONTENT_ENCODING="br",
+    )
+    assert response.status_code == 415
+
+
+@pytest.mark.parametrize(
+    "content_type",
+    ["application/gzip", "application/zstd"],
+)
+def test_transform_compressed_report_file(content_type):
+    if content_type == "application/zstd":
+        zstandard = pytest.importorskip("zstandard")
+        compress = zstandard.ZstdCompressor().compress
+    else:
+        compress = gzip.compress
+    data, amount = compressed_report(compress)
+    response = APIClient().post(
+        reverse("transform"),
+        data={"report": SimpleUploadedFile("report", data, content_type)},
+        format="multipart",
+    )
+    assert response.status_code == 200
+    assert amount_of_results(response.data) == amount
+
+
+@pytest.mark.parametrize("encoding", ["json", "msgpack"])
+def test_transform_structured_report(encoding):
+    report = gen_report(generate("host", 2), generate("oid", 3))
+    xml = xmltodict.unparse({"report": {"report": report}})
+    client = APIClient()
+    expected = client.post(
+        reverse("transform"), data=xml, content_type="application/xml"
+    ).data
+    if encoding == "msgpack":
+        msgpack = pytest.importorskip("msgpack")
+        response = client.post(
+            reverse("transform"),
+            data=msgpack.packb(xmltodict.parse(xml)),
+            content_type="application/msgpack",
+        )
+    else:
+        response = client.post(
+            reverse("transform"), data=xmltodict.parse(xml), format="json"
+        )
+    assert response.status_code == 200
+    assert load(response.data)["results"] == load(expected)["results"]
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        ["report"],
+        {},
+        {"foo": 1},
+        {"report": "x"},
+        {"report": {"report": ["x"]}},
+    ],
+)
+def test_transform_structured_report_without_report(data):
+    response = APIClient().post(reverse("transform"), data=data, format="json")
+    assert response.status_code == 400
+
+
+def batch_reports(amount: int) -> List[Tuple[str, bytes, int]]:
+    reports = []
+    for i in range(amount):
+        report = gen_report(generate("host", 2), generate("oid", i + 1))
+        xml = xmltodict.unparse({"report": {"report": report}})
+        amount = len(report["results"]["result"])
+        reports.append((f"report_{i}.xml", xml.encode(), amount))
+    return reports
+
+
+def assert_batch_items(items, reports):
+    assert [item["file"] for item in items] == [name for name, _, _ in reports]
+    for item, (_, _, amount) in zip(items, reports):
+        assert amount_of_results(item["name"]) == amount
+
+
+def test_transform_batch_multipart():
+    reports = batch_reports(3)
+    response = APIClient().post(
+        reverse("transform_batch"),
+        data={
+            name: SimpleUploadedFile(name, data, "text/xml")
+            for name, data, _ in reports
+        },
+        format="multipart",
+    )
+    assert response.status_code == 200
+    assert_batch_items(response.data, reports)
+
+
+@patch("pheme.settings.TRANSFORM_BATCH_WORKERS", 1)
+@patch("pheme.settings.TRANSFORM_SPOOL_SIZE", 0)
+def test_transform_batch_closes_spooled_reports():
+    reports = batch_reports(2)
+    opened = []
+
+    def tracked_open(*args, **kwargs):
+        opened.append(open(*args, **kwargs))  # pylint: disable=R1732
+        return opened[-1]
+
+    with patch("pheme.parser.batch.open", tracked_open, create=True):
+        response = APIClient().post(
+            reverse("transform_batch"),
+            data={
+                name: SimpleUploadedFile(name, data, "text/xml")
+                for name, data, _ in reports
+            },
+            format="multipart",
+        )
+    assert response.status_code == 200
+    assert_batch_items(response.data, reports)
+    assert opened and all(source.closed for source in opened)
+
+
+@patch("pheme.settings.TRANSFORM_BATCH_WORKERS", 2)
+def test_transform_batch_tar():
+    reports = batch_reports(3)
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w:gz") as tar:
+        for name, data, _ in reports:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    response = APIClient().post(
+        reverse("transform_batch"),
+        data=archive.getvalue(),
+        content_type="application/x-tar",
+    )
+    assert response.status_code == 200
+    assert_batch_items(response.data, reports)
+
+
+def test_batch_keeps_at_most_spool_size_in_memory():
+    reports = batch_reports(3)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, mode="w") as zipped:
+        for name, data, _ in reports:
+            zipped.writestr(name, data)
+    archive.seek(0)
+    spool_size = len(reports[0][1]) + len(reports[1][1])
+    with patch("pheme.settings.TRANSFORM_SPOOL_SIZE", spool_size):
+        batch = ZipParser().parse(archive)
+    try:
+        assert [isinstance(report.content, bytes) for report in batch] == [
+            True,
+            True,
+            False,
+        ]
+        with open(batch[2].content, "rb") as spooled:
+            assert spooled.read() == reports[2][1]
+    finally:
+        batch.close()
+
+
+def test_transform_batch_zip_reports_failures_per_file():
+    reports = batch_reports(2)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, mode="w") as zipped:
+        zipped.writestr("broken.xml", b"<report><report>")
+        for name, data, _ in reports:
+            zipped.writestr(f"{name}.gz", gzip.compress(data))
+    response = APIClient().post(
+        reverse("transform_batch"),
+        data=archive.getvalue(),
+        content_type="application/zip",
+    )
+    assert response.status_code == 200
+    assert response.data[0]["file"] == "broken.xml"
+    assert "error" in response.data[0]
+    assert_batch_items(
+        response.data[1:],
+        [(f"{name}.gz", data, amount) for name, data, amount in reports],
+    )
+
+
+def wait_for_job(client: APIClient, job_id: str) -> dict:
+    url = reverse("transform_job_status", kwargs={"job_id": job_id})
+    for _ in range(100):
+        job = client.get(url).data
+        if job["state"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+@patch("pheme.parser.xml.ReportStream.progress_interval", 1)
+def test_transform_job():
+    data, amount = compressed_report(lambda data: data)
+    client = APIClient()
+    response = client.post(
+        reverse("transform_job"), data=data, content_type="application/xml"
+    )
+    assert response.status_code == 202
+    job = wait_for_job(client, response.data)
+    assert job["state"] == "done"
+    assert job["results"] == amount
+    assert amount_of_results(job["name"]) == amount
+
+
+def test_transform_job_failure():
+    client = APIClient()
+    response = client.post(
+        reverse("transform_job"),
+        data=b"<report><report>",
+        content_type="application/xml",
+    )
+    assert response.status_code == 202
+    job = wait_for_job(client, response.data)
+    assert job["state"] == "failed"
+    assert job["error"]
+
+
+def test_transform_job_rejected_when_queue_is_full():
+    data, _ = compressed_report(lambda data: data)
+    with patch("pheme.jobs.submit", return_value=None):
+        response = APIClient().post(
+            reverse("transform_job"), data=data, content_type="application/xml"
+        )
+    assert response.status_code == 503
+
+
+def test_unknown_transform_job():
+    response = APIClient().get(
+        reverse("transform_job_status", kwargs={"job_id": "unknown"})
+    )
+    assert response.status_code == 404
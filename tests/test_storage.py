@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+# tests/test_storage.py
+# Copyright (C) 2020-2021 Greenbone AG
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from collections import Counter
+from unittest.mock import patch
+
+import pytest
+import xmltodict
+from django.core.cache.backends import filebased
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from pheme import storage
+from pheme.cache import FileBasedCache
+from pheme.errors import MissingChunkError
+from pheme.transformation.scanreport import gvmd
+from pheme.transformation.scanreport.model import as_dict, shallow_asdict
+from pheme.transformation.scanreport.renderer import enforce_limit
+from tests.generate_test_data import gen_report
+
+
+def redis_backend() -> storage.RedisBackend:
+    fakeredis = pytest.importorskip("fakeredis")
+    return storage.RedisBackend(client=fakeredis.FakeRedis(), timeout=60)
+
+
+@pytest.fixture
+def sqlite_backend(tmp_path):
+    return storage.SQLiteBackend(str(tmp_path / "pheme.sqlite3"), timeout=60)
+
+
+@pytest.mark.parametrize(
+    "create",
+    [storage.DjangoCacheBackend, redis_backend, "sqlite_backend"],
+)
+def test_backend(create, request):
+    if isinstance(create, str):
+        backend = request.getfixturevalue(create)
+    else:
+        backend = create()
+    backend.store("a", {"value": 1})
+    backend.store_many({"b": [2], "c": "3"})
+    assert backend.load("a") == {"value": 1}
+    assert backend.exists("b")
+    assert backend.get_many(["a", "c", "missing"]) == {
+        "a": {"value": 1},
+        "c": "3",
+    }
+    assert backend.touch("a")
+    assert backend.missing(["a", "missing", "c"]) == ["missing"]
+    backend.delete("a", "b")
+    assert backend.load("a") is None
+    assert not backend.exists("b")
+    assert not backend.touch("b")
+
+
+def test_transform_and_render_with_redis_backend():
+    backend = redis_backend()
+    data = xmltodict.unparse(
+        {"report": {"report": gen_report(["host_0"], ["oid_0", "oid_1"])}}
+    )
+    client = APIClient()
+    with patch("pheme.storage.backend", return_value=backend):
+        name = client.post(
+            reverse("transform"), data=data, content_type="application/xml"
+        ).data
+        assert backend.load(name)["internal_name"] == name
+        response = client.get(
+            reverse("report", kwargs={"name": name}),
+            HTTP_ACCEPT="application/json",
+        )
+    assert response.status_code == 200
+    assert response.data["internal_name"] == name
+
+
+def test_sqlite_backend_stores_reports_per_host_and_result(sqlite_backend):
+    report = shallow_asdict(
+        gvmd.transform(
+            {
+                "report": gen_report(
+                    [f"host_{i}" for i in range(4)],
+                    [f"oid_{i}" for i in range(3)],
+                )
+            }
+        )
+    )
+    cached = storage.DjangoCacheBackend()
+    cached.store("report", report)
+    sqlite_backend.store("report", report)
+    assert as_dict(sqlite_backend.load("report")) == as_dict(report)
+    host = report["results"][1].host
+    assert as_dict(sqlite_backend.load_host("report", host)) == as_dict(
+        report["results"][1]
+    )
+    assert sqlite_backend.load_host("report", "unknown") is None
+    for criteria in [
+        {},
+        {"host": host},
+        {"oid": "oid_2"},
+        {"threat": "High"},
+        {"min_severity": 0.15},
+        {"host": host, "min_severity": 0.15},
+    ]:
+        expected = cached.load_results("report", **criteria)
+        assert as_dict(sqlite_backend.load_results("report", **criteria)) == (
+            as_dict(expected)
+        )
+        assert sqlite_backend.count_results("report", **criteria) == len(
+            expected
+        )
+    assert sqlite_backend.count_results("report", threat="High") > 0
+    sqlite_backend.delete("report")
+    assert sqlite_backend.load("report") is None
+
+
+@pytest.mark.parametrize("grouping", ["host", "nvt"])
+@pytest.mark.parametrize("codec", ["pickle", "msgpack"])
+def test_serialized_report_equals_report(grouping, codec):
+    if codec == "msgpack":
+        pytest.importorskip("msgpack")
+    pytest.importorskip("zstandard")
+    scan_results = gen_report(["host_0", "host_1", "host_2"], ["oid_0"])
+    nvt = scan_results["results"]["result"][0]["nvt"]
+    for result in scan_results["results"]["result"]:
+        result["nvt"] = dict(nvt)
+    report = shallow_asdict(
+        gvmd.transform({"report": scan_results}, grouping=grouping)
+    )
+    with patch("pheme.settings.STORAGE_CODEC", codec):
+        data = storage.dumps(report)
+    assert data.startswith(b"PHM\x01" + codec[0].encode())
+    loaded = storage.loads(data)
+    assert as_dict(loaded) == as_dict(report)
+    if grouping == "host":
+        # results sharing their NVT fields keep sharing them
+        def shared(report):
+            return len(
+                {
+                    id(result._nvt)  # pylint: disable=protected-access
+                    for host in report["results"]
+                    for result in host.results
+                }
+            )
+
+        assert shared(loaded) == shared(report) == 1
+
+
+@patch("pheme.settings.STORAGE_CODEC", "msgpack")
+def test_serialization_falls_back_to_pickle():
+    pytest.importorskip("zstandard")
+    value = {"tuple": (1, "2"), "complex": 3j}
+    data = storage.dumps(value)
+    assert data.startswith(b"PHM\x01p")
+    assert storage.loads(data) == value
+
+
+@patch("pheme.settings.STORAGE_CODEC", "msgpack")
+def test_append_state_keeps_its_types():
+    pytest.importorskip("msgpack")
+    pytest.importorskip("zstandard")
+    report = gen_report(["host_0", "host_1"], [f"oid_{i}" for i in range(4)])
+    results = report["results"]["result"]
+    client = APIClient()
+
+    def upload(url, part):
+        return client.post(
+            url,
+            data={"report": {"report": {**report, "results": part}}},
+            format="xml",
+        )
+
+    name = upload(reverse("transform"), {"result": results[:2]}).data
+    url = reverse("append", kwargs={"name": name})
+    for start in range(2, len(results), 2):
+        response = upload(url, {"result": results[start : start + 2]})
+        assert response.status_code == 200
+        state = storage.load(f"{name}-append-state")
+        assert isinstance(state["hosts_per_nvt"], Counter)
+    assert storage.loads(storage.dumps(state)) == state
+
+
+def test_values_stored_before_serialization_are_loaded(tmp_path):
+    pdf = b"%PDF-1.7 rendered before"
+    # the stock cache of older versions pickled and compressed the bytes
+    stock = filebased.FileBasedCache(str(tmp_path), {})
+    stock.set("application/pdf/report", pdf)
+    stock.set("value", {"tuple": (1, "2")})
+    backend = storage.DjangoCacheBackend()
+    backend.cache = FileBasedCache(str(tmp_path), {})
+    assert backend.load("application/pdf/report") == pdf
+    assert backend.load("value") == {"tuple": (1, "2")}
+    assert storage.loads(pdf) is pdf
+    assert storage.loads(None) is None
+
+
+def __host_report(hosts: int):
+    return shallow_asdict(
+        gvmd.transform(
+            {
+                "report": gen_report(
+                    [f"host_{i}" for i in range(hosts)],
+                    [f"oid_{i}" for i in range(3)],
+                )
+            }
+        )
+    )
+
+
+@pytest.mark.parametrize(
+    "create",
+    [storage.DjangoCacheBackend, redis_backend, "sqlite_backend"],
+)
+def test_reports_are_loaded_in_chunks_of_hosts(create, request):
+    if isinstance(create, str):
+        backend = request.getfixturevalue(create)
+    else:
+        backend = create()
+    report = __host_report(5)
+    with patch("pheme.settings.STORAGE_CHUNK_SIZE", 2):
+        backend.store_report("report", report)
+        loaded = backend.load("report")
+    hosts = loaded["results"]
+    assert isinstance(hosts, storage.LazyHosts)
+    assert len(hosts) == 5
+    assert len(hosts.chunk_names()) == 3
+    assert as_dict(list(hosts)) == as_dict(report["results"])
+    assert as_dict(hosts[-1]) == as_dict(report["results"][-1])
+    assert as_dict(list(hosts[1:4])) == as_dict(report["results"][1:4])
+    assert all(len(host.results) == 1 for host in hosts.limited(1))
+    # the limit applies to the loaded hosts only
+    assert as_dict(list(hosts)) == as_dict(report["results"])
+
+
+@pytest.mark.parametrize(
+    "create",
+    [storage.DjangoCacheBackend, redis_backend, "sqlite_backend"],
+)
+@patch("pheme.settings.STORAGE_CHUNK_SIZE", 2)
+def test_append_stores_just_the_chunks_of_appended_hosts(create, request):
+    if isinstance(create, str):
+        backend = request.getfixturevalue(create)
+    else:
+        backend = create()
+    report = gen_report(
+        [f"host_{i}" for i in range(7)], [f"oid_{i}" for i in range(3)]
+    )
+    results = report["results"]["result"]
+    ips = list(dict.fromkeys(result["host"]["text"] for result in results))
+
+    def of(*hosts):
+        return [result for result in results if result["host"]["text"] in hosts]
+
+    def data(part):
+        return {"report": {"report": {**report, "results": {"result": part}}}}
+
+    # the fourth host gets another result and the seventh one is new
+    added = [dict(of(ips[3])[0])] + of(ips[6])
+    expected = shallow_asdict(gvmd.transform(data(of(*ips[:6]) + added)))
+    backend.store_report(
+        "report", shallow_asdict(gvmd.transform(data(of(*ips[:5]))))
+    )
+    loaded = backend.load("report")
+    loaded["results"] = storage.ChangedHosts(loaded["results"])
+    state = gvmd.append(loaded, data(of(ips[5])))
+    backend.update_report("report", loaded)
+    loaded = backend.load("report")
+    loaded["results"] = storage.ChangedHosts(loaded["results"])
+    with patch.object(
+        backend, "load_chunk", wraps=backend.load_chunk
+    ) as load_chunk:
+        gvmd.append(loaded, data(added), state)
+    assert [call.args[1] for call in load_chunk.call_args_list] == [1]
+    assert sorted(loaded["results"].changed_chunks()) == [1, 3]
+    backend.update_report("report", loaded)
+    loaded = backend.load("report")
+    assert loaded["results"].results_per_host() == [
+        len(host.results) for host in expected["results"]
+    ]
+    assert as_dict(list(loaded["results"])) == as_dict(expected["results"])
+    assert loaded["overview"]["hosts"] == expected["overview"]["hosts"]
+    assert loaded["overview"]["nvts"] == expected["overview"]["nvts"]
+
+
+def test_report_with_missing_chunks_is_missing():
+    backend = storage.DjangoCacheBackend()
+    backend.store_report("report", __host_report(5), chunk_size=2)
+    hosts = backend.load("report")["results"]
+    backend.delete(storage.chunk_name("report", 1))
+    assert backend.load("report") is None
+    with pytest.raises(MissingChunkError):
+        list(hosts)
+    with pytest.raises(MissingChunkError):
+        hosts[3]  # pylint: disable=pointless-statement
+    with patch("pheme.storage.backend", return_value=backend):
+        response = APIClient().get(
+            reverse("report", kwargs={"name": "report"}),
+            HTTP_ACCEPT="text/csv",
+        )
+    assert response.status_code == 404
+
+
+def test_chunks_are_culled_with_their_report(tmp_path):
+    backend = storage.DjangoCacheBackend()
+    backend.cache = FileBasedCache(
+        str(tmp_path), {"OPTIONS": {"MAX_ENTRIES": 4, "CULL_FREQUENCY": 2}}
+    )
+    report = __host_report(20)
+    for i in range(8):
+        backend.store_report(f"report-{i}", report, chunk_size=2)
+    loaded = [backend.load(f"report-{i}") for i in range(8)]
+    # culling removes whole reports instead of chunks of them
+    assert None in loaded
+    for header in filter(None, loaded):
+        assert as_dict(list(header["results"])) == as_dict(report["results"])
+    assert len(list(tmp_path.glob("*.chunks"))) == len(
+        list(filter(None, loaded))
+    )
+    for i in range(8):
+        backend.delete(f"report-{i}")
+    assert not list(tmp_path.iterdir())
+
+
+@pytest.mark.parametrize(
+    "create",
+    [storage.DjangoCacheBackend, "sqlite_backend"],
+)
+def test_enforce_limit_on_lazy_hosts(create, request):
+    if isinstance(create, str):
+        backend = request.getfixturevalue(create)
+    else:
+        backend = create()
+    backend.store_report("report", __host_report(5), chunk_size=2)
+    with patch.object(
+        backend, "load_chunk", side_effect=AssertionError("loaded a chunk")
+    ):
+        data = enforce_limit(
+            backend.load("report"),
+            {"limits": {"pdf": {"hosts": 3, "results": 1}}},
+        )
+    assert isinstance(data["results"], storage.LazyHosts)
+    assert len(data["results"]) == 3
+    assert [len(host.results) for host in data["results"]] == [1, 1, 1]
+    assert data["comment"] == "Host limit 3; Result limit: 1."
+
+
+@patch("pheme.settings.STORAGE_CHUNK_SIZE", 2)
+def test_render_report_stored_in_chunks():
+    data = xmltodict.unparse(
+        {
+            "report": {
+                "report": gen_report(
+                    [f"host_{i}" for i in range(5)], ["oid_0", "oid_1"]
+                )
+            }
+        }
+    )
+    client = APIClient()
+    name = client.post(
+        reverse("transform"), data=data, content_type="application/xml"
+    ).data
+    assert isinstance(storage.load(name)["results"], storage.LazyHosts)
+    response = client.get(reverse("load_cache", kwargs={"key": name}))
+    assert response.status_code == 200
+    assert len(response.json()["results"]) == 5
+    url = reverse("report", kwargs={"name": name})
+    response = client.get(url, HTTP_ACCEPT="application/json")
+    assert response.status_code == 200
+    assert len(response.json()["results"]) == 5
+    response = client.get(url, HTTP_ACCEPT="text/csv")
+    assert response.status_code == 200
+    assert all(f"host_{i}" in response.content.decode() for i in range(5))
+
+
+@pytest.mark.parametrize("grouping", ["host", "nvt"])
+def test_reference_touches_report_without_loading_it(grouping):
+    backend = storage.DjangoCacheBackend()
+    report = __host_report(5)
+    if grouping == "nvt":
+        report = {**report, "grouping": "nvt"}
+    with (
+        patch("pheme.storage.backend", return_value=backend),
+        patch("pheme.settings.STORAGE_CHUNK_SIZE", 2),
+    ):
+        name = storage.store("scanreport", report)
+        storage.add_reference("key", name)
+        with (
+            patch.object(backend, "touch", wraps=backend.touch) as touch,
+            patch.object(backend, "load", wraps=backend.load) as load,
+        ):
+            assert storage.reference("key") == name
+    assert name not in [call.args[0] for call in load.call_args_list]
+    touched = [call.args[0] for call in touch.call_args_list]
+    assert name in touched
+    chunks = [storage.chunk_name(name, index) for index in range(3)]
+    if grouping == "host":
+        assert all(chunk in touched for chunk in chunks)
+    else:
+        assert not backend.exists(chunks[0])
@@ -16,12 +16,17 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import gzip
+import hashlib
 from dataclasses import dataclass
+from io import BytesIO
 from typing import Dict
 
 import pytest
+import xmltodict
 
-from pheme.parser.xml import XMLParser
+from pheme.parser.xml import ReportStream, XMLParser
+from tests.generate_test_data import gen_report
 
 
 @dataclass
@@ -45,3 +50,134 @@ def test_parsing(xml):
     under_test = XMLParser()
     result = under_test.parse(xml.data)
     assert result == xml.expected
+
+
+@pytest.mark.parametrize("nested", [True, False])
+def test_streaming_yields_items_like_xmltodict(nested):
+    report = gen_report(["first", "second"], ["oid_1", "oid_2"])
+    document = {"report": {"report": report}} if nested else {"report": report}
+    xml = xmltodict.unparse(document)
+    expected = xmltodict.parse(
+        xml, attr_prefix="", cdata_key="text", dict_constructor=dict
+    )["report"]
+    if nested:
+        expected = expected["report"]
+    under_test = ReportStream(BytesIO(xml.encode()))
+    items = list(under_test)
+    assert [item for kind, item in items if kind == "result"] == expected[
+        "results"
+    ]["result"]
+    assert [item for kind, item in items if kind == "host"] == expected["host"]
+    assert under_test.header["task"] == expected["task"]
+    assert "results" not in under_test.header
+    assert "host" not in under_test.header
+
+
+def test_streaming_ignores_nested_results():
+    xml = (
+        "<report id='a'><results><result id='1'><notes><note>"
+        "<result id='1'/></note></notes></result></results>"
+        "<host><ip>1.1.1.1</ip></host></report>"
+    )
+    under_test = ReportStream(BytesIO(xml.encode()))
+    items = list(under_test)
+    assert [kind for kind, _ in items] == ["result", "host"]
+    assert items[0][1] == {
+        "id": "1",
+        "notes": {"note": {"result": {"id": "1"}}},
+    }
+    assert under_test.header == {"id": "a"}
+
+
+def test_streaming_drops_filtered_results_early():
+    xml = (
+        "<report id='a'><results>"
+        "<result id='1'><threat>Log</threat><description>a</description>"
+        "</result>"
+        "<result id='2'><threat>High</threat><description>b</description>"
+        "</result>"
+        "</results></report>"
+    )
+    seen = []
+
+    def result_filter(result):
+        seen.append(dict(result))
+        return result.get("threat") != "Log"
+
+    under_test = ReportStream(BytesIO(xml.encode()), result_filter)
+    items = list(under_test)
+    assert items == [
+        ("result", {"id": "2", "threat": "High", "description": "b"})
+    ]
+    # the description of the dropped result is not parsed anymore
+    assert {"id": "1", "threat": "Log", "description": "a"} not in seen
+
+
+class _Unseekable:
+    def __init__(self, data: bytes):
+        self.data = BytesIO(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self.data.read(size)
+
+
+def test_streaming_spools_big_unseekable_sources_to_files():
+    report = gen_report(["first", "second"], ["oid_1", "oid_2"])
+    xml = xmltodict.unparse({"report": report}).encode()
+    expected = list(ReportStream(BytesIO(xml)))
+    under_test = ReportStream(_Unseekable(xml))
+    under_test.spool_size = 1024
+    under_test.chunk_size = 512
+    assert under_test.sha256() == hashlib.sha256(xml).hexdigest()
+    # the spooled file is parsed memory mapped
+    assert under_test.source.fileno() >= 0
+    assert list(under_test) == expected
+    small = ReportStream(_Unseekable(xml))
+    small.sha256()
+    assert isinstance(small.source, BytesIO)
+    assert list(small) == expected
+
+
+def test_streaming_spools_compressed_sources_compressed():
+    report = gen_report(["first", "second"], ["oid_1", "oid_2"])
+    xml = xmltodict.unparse({"report": report}).encode()
+    compressed = gzip.compress(xml)
+    expected = list(ReportStream(BytesIO(xml)))
+    under_test = ReportStream(_Unseekable(compressed), encoding="gzip")
+    under_test.spool_size = len(compressed) + 1
+    assert under_test.sha256() == hashlib.sha256(compressed).hexdigest()
+    assert under_test.source.getbuffer().nbytes == len(compressed)
+    assert list(under_test) == expected
+
+
+def test_streaming_skips_elements_outside_of_projection():
+    xml = (
+        "<report id='a'><ports><port>80</port></ports><scan_start>now"
+        "</scan_start><results><result id='1'><severity>5.0</severity>"
+        "<delta>changed</delta></result></results>"
+        "<host><ip>1.1.1.1</ip><detail><name>hostname</name><value>a</value>"
+        "</detail><detail><name>other</name><value>b</value></detail></host>"
+        "</report>"
+    )
+    under_test = ReportStream(
+        BytesIO(xml.encode()),
+        projection={
+            "scan_start": None,
+            "results": {"result": {"severity": None}},
+            "host": {
+                "ip": None,
+                "detail": (
+                    {"name": None, "value": None},
+                    lambda detail: detail.get("name") != "other",
+                ),
+            },
+        },
+    )
+    assert list(under_test) == [
+        ("result", {"id": "1", "severity": "5.0"}),
+        (
+            "host",
+            {"ip": "1.1.1.1", "detail": {"name": "hostname", "value": "a"}},
+        ),
+    ]
+    assert under_test.header == {"id": "a", "scan_start": "now"}